@@ -0,0 +1,137 @@
+# Throughput benchmark of ZiherPlus engines against the local mock ZiHeR
+# Author: Marek Szymański
+
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+
+import openpyxl
+
+from excel_specific import COLS
+from mock_ziher import MockZiher
+from zih_metrics import RunMetrics
+from zih_pacing import AdaptivePacer
+from ziher_http import ZiherPlusHTTP
+from ziher_plus import ZiherPlus
+
+ENGINES = {
+    "http": lambda **kw: ZiherPlusHTTP.Session(**kw),
+    "chrome": lambda **kw: ZiherPlus.Chrome(**kw),
+    "firefox": lambda **kw: ZiherPlus.Firefox(**kw),
+}
+FIRST_ROW = 2
+
+
+def make_workbook(path: str, rows: int, seed: int = 0) -> None:
+    '''Saves a workbook with `rows` random records, laid out as described in COLS'''
+    rnd = random.Random(seed)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "dane"
+    ws.append([COLS.get(c, {"name": ""})["name"] for c in range(1, max(COLS) + 1)])
+    amount_cols = {
+        kind: [c for c, v in COLS.items() if v["type"] == kind] for kind in ("income", "cost")
+    }
+    start = datetime.datetime(2024, 1, 1)
+    for i in range(1, rows + 1):
+        row = [None] * max(COLS)
+        row[0] = i
+        row[1] = start + datetime.timedelta(days=i % 365)
+        row[2] = f"FV/{i}/2024"
+        row[3] = f"Rekord testowy {i}"
+        row[rnd.choice(amount_cols[rnd.choice(["income", "cost"])]) - 1] = round(rnd.uniform(1, 2000), 2)
+        ws.append(row)
+    wb.save(path)
+
+
+def run(
+    engine: str, mock: MockZiher, path: str, rows: int, streaming: bool, fast: bool = False, pacing: bool = False
+) -> dict:
+    '''Imports all `rows` of the workbook at `path` into `mock` with `engine`, timing each stage
+
+    :param fast: start browser engines with the fast profile (see zih_browsers.py)
+    :param pacing: pace the records with an AdaptivePacer (see zih_pacing.py)
+    '''
+    stages = {}
+    metrics = RunMetrics()
+    pacer = AdaptivePacer() if pacing else None
+    options = {"fast": True} if fast and engine != "http" else {}
+    if pacer:
+        options["pacer"] = pacer
+
+    t = time.perf_counter()
+    zp = ENGINES[engine](human_control=False, base_url=mock.url, streaming=streaming, metrics=metrics, **options)
+    stages["start"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    zp.load(path, "dane")
+    stages["load"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    zp.login("benchmark@zhr.pl", "haslo", "pomorze")
+    stages["login"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    zp.send("bankowa", FIRST_ROW, FIRST_ROW + rows - 1)
+    stages["send"] = time.perf_counter() - t
+
+    zp.logout().quit()
+    sent = sum(r["status"] == "sent" for r in zp.report)
+    per_record = metrics.summary()["stages"]
+    return {
+        "engine": engine + (" (fast)" if options.get("fast") else ""),
+        "rows": rows,
+        "sent": sent,
+        "failed": sum(r["status"] == "failed" for r in zp.report),
+        "records/min": 60 * len(zp.report) / stages["send"] if stages["send"] else 0,
+        "ms/record": 1000 * stages["send"] / max(len(zp.report), 1),
+        **{f"{k} [s]": v for k, v in stages.items()},
+        **{f"{k} p50/p95 [ms]": f"{1000 * per_record[k]['p50']:.1f}/{1000 * per_record[k]['p95']:.1f}"
+           for k in ("open_form", "page_load", "fill", "commit") if k in per_record},
+        **({"delay [s]": pacer.summary()["delay"]} if pacer else {}),
+    }
+
+
+def print_table(results: list[dict]) -> None:
+    '''Prints `results` as an aligned text table'''
+    columns = list(dict.fromkeys(c for r in results for c in r))
+    cells = [[f"{r[c]:.2f}" if isinstance(r.get(c), float) else str(r.get(c, "")) for c in columns]
+             for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in cells)) for i, c in enumerate(columns)]
+    print(" | ".join(c.rjust(w) for c, w in zip(columns, widths)))
+    print("-+-".join("-" * w for w in widths))
+    for row in cells:
+        print(" | ".join(c.rjust(w) for c, w in zip(row, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ZiherPlus engines against the local mock ZiHeR")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="rows per run")
+    parser.add_argument("--engines", nargs="+", default=["http"], choices=list(ENGINES))
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0, help="random extra latency, in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0, help="fraction of rejected commits")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests failing with 500")
+    parser.add_argument("--streaming", action="store_true", help="load workbooks in streaming mode")
+    parser.add_argument("--fast", action="store_true", help="also run browser engines with the fast profile")
+    parser.add_argument("--pacing", action="store_true", help="pace records adaptively")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.sizes:
+            path = os.path.join(tmp, f"bench_{rows}.xlsx")
+            make_workbook(path, rows)
+            for engine in args.engines:
+                with MockZiher(latency=args.latency, jitter=args.jitter,
+                               failure_rate=args.failure_rate, error_rate=args.error_rate) as mock:
+                    results.append(run(engine, mock, path, rows, args.streaming, pacing=args.pacing))
+                if args.fast and engine != "http":
+                    with MockZiher(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                                   error_rate=args.error_rate) as mock:
+                        results.append(run(engine, mock, path, rows, args.streaming, fast=True, pacing=args.pacing))
+
+    print_table(results)
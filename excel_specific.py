@@ -44,4 +44,22 @@ COLS = {
     23: {"name": "noclegi",                             "type": "cost", "id": 11},
     24: {"name": "transport",                           "type": "cost", "id": 12},
     25: {"name": "inne",                                "type": "cost", "id": 13},
-}
\ No newline at end of file
+    # parts of the cost financed from 1% of tax and from grants - "id" is the cost
+    # item they belong to, None for the row's only cost column with an amount
+    26: {"name": "w tym z 1%",                          "type": "onep", "id": None},
+    27: {"name": "w tym z dotacji",                     "type": "grant", "id": None},
+}
+
+'''Aggregate columns - not imported, but used to double-check the amounts before sending
+
+"of" tells what the column holds:
+    "income"  - sum of the row's income columns
+    "cost"    - sum of the row's cost columns
+    "balance" - running balance: previous row's balance + income - cost
+Mismatches are reported as warnings. Remove entries which don't match your spreadsheet.
+'''
+AGGREGATES = {
+    9: {"name": "razem wpływy",                         "of": "income"},
+    10: {"name": "razem wydatki",                       "of": "cost"},
+    11: {"name": "saldo",                               "of": "balance"},
+}
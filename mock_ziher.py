@@ -0,0 +1,381 @@
+# Local stand-in for ZiHeR, for testing and benchmarking ZiherPlus
+# Author: Marek Szymański
+
+import argparse
+import html
+import random
+import re
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from excel_specific import COLS
+from site_specific import FormFieldIDs, HTMLLocators
+
+'''Logbooks served by the mock: id -> link text on the welcome page'''
+JOURNALS = {
+    1: HTMLLocators["BankLogLinkText"],
+    2: HTMLLocators["FinLogLinkText"],
+}
+CATEGORIES = {
+    kind: [v["name"] for k, v in sorted(COLS.items()) if v["type"] == kind]
+    for kind in ("income", "cost")
+}
+ITEM_AMOUNT = re.compile(r"^entry\[items_attributes\]\[\d+\]\[amount\]$")
+
+
+class MockZiher:
+    '''Minimal ZiHeR look-alike served from a background thread
+
+    Serves the sign-in page, the welcome page with logbook links, paginated logbooks
+    and the new income/cost entry forms, with the same element ids, classes and link texts
+    ZiherPlus looks for (see site_specific.py). Sessions and CSRF tokens are checked like
+    in the real app. Commited entries are kept in memory, in `entries`.
+
+    :param host: address to listen on
+    :param port: port to listen on, 0 picks a free one
+    :param latency: seconds added to every response
+    :param jitter: random extra latency, up to this many seconds
+    :param failure_rate: fraction of entry commits rejected with a validation error
+    :param error_rate: fraction of requests failing with 500 Internal Server Error, like a passing outage
+    :param page_size: entries per logbook page
+    :param password: the only password accepted, None accepts any
+
+    :ivar url: base url of the server, to be passed as `base_url` to ZiherPlus
+    :ivar entries: commited entries, journal id -> list of dicts
+    :ivar requests: number of requests served
+    '''
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0,
+        jitter: float = 0,
+        failure_rate: float = 0,
+        error_rate: float = 0,
+        page_size: int = 50,
+        password: str = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.password = password
+        self.entries = {j: [] for j in JOURNALS}
+        self.requests = 0
+        self.sessions = {}  # session id -> {"email", "csrf"}
+        self.sign_in_tokens = {}  # not yet signed in session id -> csrf token of its sign-in form
+        self.lock = threading.Lock()
+        self.__server = ThreadingHTTPServer((host, port), _handler(self))
+        self.__server.daemon_threads = True
+        self.url = f"http://{host}:{self.__server.server_address[1]}"
+        self.__thread = None
+
+    def start(self) -> "MockZiher":
+        '''Starts serving in a background thread'''
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self) -> None:
+        '''Stops the server'''
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def expire_sessions(self) -> None:
+        '''Signs everyone out, like ZiHeR does after a while'''
+        with self.lock:
+            self.sessions.clear()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _handler(mock: MockZiher):
+    '''Request handler class bound to the `mock` state'''
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+        disable_nagle_algorithm = True  # headers and body go out separately, don't delay the body
+
+        def log_message(self, format, *args):
+            pass
+
+        # ------------------------------------------------------
+        # Routing
+        # ------------------------------------------------------
+
+        def do_GET(self):
+            self.__route("GET")
+
+        def do_POST(self):
+            self.__route("POST")
+
+        def __route(self, method: str):
+            with mock.lock:
+                mock.requests += 1
+            if mock.latency or mock.jitter:
+                time.sleep(mock.latency + random.uniform(0, mock.jitter))
+
+            url = urlsplit(self.path)
+            self.query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            self.form = {}
+            if method == "POST":
+                length = int(self.headers.get("Content-Length", 0))
+                self.form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+            if mock.error_rate and random.random() < mock.error_rate:
+                return self.__send(500, "Internal server error")
+
+            parts = [p for p in url.path.split("/") if p]
+            if parts == ["robots.txt"]:
+                return self.__send(200, "User-agent: *\n", "text/plain")
+            if not parts:
+                return self.__send(404, "Not found")
+            self.region, route = parts[0], parts[1:]
+            self.session = mock.sessions.get(self.__cookie())
+
+            if route == ["users", "sign_in"]:
+                if method == "POST":
+                    return self.__sign_in()
+                if self.session is None:
+                    return self.__sign_in_page()
+                return self.__redirect(f"/{self.region}/")
+            if self.session is None:
+                return self.__redirect(f"/{self.region}/users/sign_in")
+            if route == ["users", "sign_out"]:
+                return self.__sign_out()
+            if route == []:
+                return self.__send(200, self.__layout("<h1>Witaj w ZiHeRze</h1>"))
+            if len(route) == 2 and route[0] == "journals" and route[1].isdigit():
+                return self.__journal(int(route[1]))
+            if route == ["entries", "new"]:
+                return self.__send(200, self.__entry_form(int(self.query.get("journal_id", 1)),
+                                                          self.query.get("type", "income")))
+            if route == ["entries"] and method == "POST":
+                return self.__create_entry()
+            return self.__send(404, self.__layout("<h1>Nie znaleziono</h1>"))
+
+        # ------------------------------------------------------
+        # Pages
+        # ------------------------------------------------------
+
+        def __sign_in_page(self):
+            csrf = secrets.token_hex(16)
+            sid = self.__cookie() or secrets.token_hex(16)
+            with mock.lock:
+                mock.sign_in_tokens[sid] = csrf
+            body = f"""
+<h1>Logowanie</h1>
+<form action="/{self.region}/users/sign_in" method="post">
+  <input type="hidden" name="authenticity_token" value="{csrf}">
+  <input type="email" name="user[email]" id="user_email">
+  <input type="password" name="user[password]" id="user_password">
+  <input type="submit" name="commit" value="Zaloguj się" class="btn btn-success">
+</form>"""
+            self.__send(200, self.__page(body, csrf), cookie=sid)
+
+        def __sign_in(self):
+            sid = self.__cookie()
+            with mock.lock:
+                expected = mock.sign_in_tokens.pop(sid, None)
+            email = self.form.get("user[email]", "")
+            if (expected is None or self.form.get("authenticity_token") != expected
+                    or not email or mock.password is not None and self.form.get("user[password]") != mock.password):
+                return self.__redirect(f"/{self.region}/users/sign_in")
+            sid = secrets.token_hex(16)
+            with mock.lock:
+                mock.sessions[sid] = {"email": email, "csrf": secrets.token_hex(16)}
+            self.__redirect(f"/{self.region}/", cookie=sid)
+
+        def __sign_out(self):
+            with mock.lock:
+                mock.sessions.pop(self.__cookie(), None)
+            self.__redirect(f"/{self.region}/users/sign_in")
+
+        def __journal(self, journal: int):
+            if journal not in JOURNALS:
+                return self.__send(404, self.__layout("<h1>Nie znaleziono</h1>"))
+            entries = mock.entries[journal]
+            page = max(1, int(self.query.get("page", 1)))
+            first = (page - 1) * mock.page_size
+            shown = entries[first:first + mock.page_size]
+
+            head = "".join(f"<th>{html.escape(c)}</th>" for c in
+                           ["Lp.", "Data", "Nr dokumentu", "Opis", "Wpływy", "Wydatki", ""])
+            rows = "".join(
+                "<tr>" + "".join(f"<td>{html.escape(str(c))}</td>" for c in [
+                    first + i + 1, e["date"], e["document_number"], e["name"],
+                    _money(e["total"]) if e["type"] == "income" else "",
+                    _money(e["total"]) if e["type"] == "cost" else "",
+                    "",
+                ]) + "</tr>"
+                for i, e in enumerate(shown)
+            )
+            pagination = ""
+            if first + mock.page_size < len(entries):
+                pagination = (f'<ul class="pagination"><li><a rel="next" '
+                              f'href="/{self.region}/journals/{journal}?page={page + 1}">&raquo;</a></li></ul>')
+            body = f"""
+<h1>{html.escape(JOURNALS[journal])}</h1>
+<a class="btn btn-sm btn-success" href="/{self.region}/entries/new?journal_id={journal}&amp;type=income">Nowy wpływ</a>
+<a class="btn btn-sm btn-success" href="/{self.region}/entries/new?journal_id={journal}&amp;type=cost">Nowy wydatek</a>
+<table class="table"><thead><tr>{head}</tr></thead><tbody>{rows}</tbody></table>
+{pagination}"""
+            self.__send(200, self.__layout(body))
+
+        def __entry_form(self, journal: int, kind: str, errors: str = "", values: dict = None) -> str:
+            values = values or {}
+            def value(name):
+                return html.escape(values.get(name, ""), quote=True)
+
+            items = []
+            for i, category in enumerate(CATEGORIES["cost" if kind == "cost" else "income"]):
+                prefix = f"entry[items_attributes][{i}]"
+                item = (f'<input type="hidden" name="{prefix}[category_id]" value="{i + 1}">'
+                        f'<label>{html.escape(category)}</label>'
+                        f'<input type="text" name="{prefix}[amount]" id="{FormFieldIDs["amountFun"](i)}" '
+                        f'value="{value(prefix + "[amount]")}">')
+                if kind == "cost":
+                    item += (f'<input type="text" name="{prefix}[amount_one_percent]" '
+                             f'id="{FormFieldIDs["onepFun"](i)}" value="{value(prefix + "[amount_one_percent]")}">'
+                             f'<input type="text" name="{prefix}[item_grants_attributes][0][amount]" '
+                             f'id="{FormFieldIDs["grantFun"](i)}" '
+                             f'value="{value(prefix + "[item_grants_attributes][0][amount]")}">')
+                items.append(f'<div class="form-group">{item}</div>')
+
+            body = f"""
+<h1>Nowy {"wydatek" if kind == "cost" else "wpływ"}</h1>{errors}
+<form action="/{self.region}/entries" method="post">
+  <input type="hidden" name="authenticity_token" value="{self.session['csrf']}">
+  <input type="hidden" name="entry[journal_id]" value="{journal}">
+  <input type="hidden" name="entry[is_expense]" value="{"true" if kind == "cost" else "false"}">
+  <input type="date" name="entry[date]" id="{FormFieldIDs['date']}" value="{value("entry[date]")}">
+  <input type="text" name="entry[document_number]" id="{FormFieldIDs['doc_nr']}" value="{value("entry[document_number]")}">
+  <input type="text" name="entry[name]" id="{FormFieldIDs['name']}" value="{value("entry[name]")}">
+  {"".join(items)}
+  <input type="submit" name="commit" value="Zapisz" class="btn btn-primary">
+</form>
+<a href="/{self.region}/journals/{journal}">Powrót do książki</a>"""
+            return self.__layout(body)
+
+        def __create_entry(self):
+            journal = int(self.form.get("entry[journal_id]", 1))
+            kind = "cost" if self.form.get("entry[is_expense]") == "true" else "income"
+            errors = []
+            if self.form.get("authenticity_token") != self.session["csrf"]:
+                errors.append("Nieprawidłowy token formularza")
+            if not self.form.get("entry[date]"):
+                errors.append("Data nie może być pusta")
+            if not self.form.get("entry[name]"):
+                errors.append("Opis nie może być pusty")
+            amounts = []
+            for k, v in self.form.items():
+                if ITEM_AMOUNT.match(k) and v.strip():
+                    try:
+                        amounts.append(float(v.replace(",", ".")))
+                    except ValueError:
+                        errors.append(f"Nieprawidłowa kwota: {v}")
+            if not amounts:
+                errors.append("Wpis musi mieć kwotę")
+            if not errors and random.random() < mock.failure_rate:
+                errors.append("Wpis nie został zapisany, spróbuj ponownie")
+
+            if errors:
+                box = ('<div id="error_explanation" class="alert alert-danger"><ul>'
+                       + "".join(f"<li>{html.escape(e)}</li>" for e in errors) + "</ul></div>")
+                return self.__send(422, self.__entry_form(journal, kind, box, self.form))
+
+            with mock.lock:
+                mock.entries[journal].append({
+                    "type": kind,
+                    "date": self.form["entry[date]"],
+                    "document_number": self.form.get("entry[document_number]", ""),
+                    "name": self.form["entry[name]"],
+                    "total": round(sum(amounts), 2),
+                    "fields": dict(self.form),
+                })
+            self.__redirect(f"/{self.region}/journals/{journal}")
+
+        # ------------------------------------------------------
+        # Helpers
+        # ------------------------------------------------------
+
+        def __layout(self, body: str) -> str:
+            journals = "".join(
+                f'<li><a href="/{self.region}/journals/{j}">{html.escape(t)}</a></li>'
+                for j, t in JOURNALS.items()
+            )
+            email = html.escape(self.session["email"])
+            nav = f"""
+<nav><ul class="nav navbar-nav">{journals}</ul>
+<ul class="nav navbar-nav pull-right"><li class="dropdown">
+  <a class="dropdown-toggle" href="#">{email}</a>
+  <ul class="dropdown-menu"><li><a rel="nofollow" data-method="delete" href="/{self.region}/users/sign_out">Wyloguj się</a></li></ul>
+</li></ul></nav>"""
+            return self.__page(nav + body, self.session["csrf"])
+
+        @staticmethod
+        def __page(body: str, csrf: str) -> str:
+            return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>ZiHeR</title>'
+                    f'<meta name="csrf-token" content="{csrf}"></head><body>{body}</body></html>')
+
+        def __cookie(self) -> str:
+            for part in self.headers.get("Cookie", "").split(";"):
+                name, _, value = part.strip().partition("=")
+                if name == "_ziher_session":
+                    return value
+            return None
+
+        def __send(self, status: int, body: str, content_type: str = "text/html", cookie: str = None):
+            data = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            if cookie:
+                self.send_header("Set-Cookie", f"_ziher_session={cookie}; Path=/; HttpOnly")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def __redirect(self, location: str, cookie: str = None):
+            self.send_response(302)
+            self.send_header("Location", location)
+            self.send_header("Content-Length", "0")
+            if cookie:
+                self.send_header("Set-Cookie", f"_ziher_session={cookie}; Path=/; HttpOnly")
+            self.end_headers()
+
+    return Handler
+
+
+def _money(value: float) -> str:
+    '''Formats `value` the Polish way, like ZiHeR does, e.g. "1 234,50"'''
+    return f"{value:,.2f}".replace(",", " ").replace(".", ",")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in ZiHeR server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0, help="random extra latency, in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0, help="fraction of rejected commits")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests failing with 500")
+    parser.add_argument("--page-size", type=int, default=50, help="entries per logbook page")
+    args = parser.parse_args()
+
+    mock = MockZiher(args.host, args.port, args.latency, args.jitter, args.failure_rate,
+                     error_rate=args.error_rate, page_size=args.page_size)
+    print(f"Mock ZiHeR at {mock.url} (e.g. {mock.url}/pomorze/users/sign_in), Ctrl+C to stop")
+    mock.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mock.stop()
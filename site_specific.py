@@ -20,6 +20,7 @@ Locators = {
     "Form": {
         "CommitButton": (By.NAME, "commit"),
         "ReturnLink": (By.LINK_TEXT, "Powrót do książki"),
+        "ErrorMessages": (By.CSS_SELECTOR, "#error_explanation li"),
     },
 }
 
@@ -31,3 +32,26 @@ FormFieldIDs = {
     'onepFun': lambda idx: f"entry_items_attributes_{idx}_amount_one_percent",
     'grantFun': lambda idx: f"entry_items_attributes_{idx}_item_grants_attributes_0_amount"
 }
+
+SiteURL = "https://ziher.zhr.pl"
+
+# Counterparts of the Locators for engines working on raw HTML instead of a browser
+HTMLLocators = {
+    "SignInPath": "users/sign_in",
+    "MailInputID": "user_email",
+    "PasswordInputID": "user_password",
+    "CSRFMetaName": "csrf-token",
+    "BankLogLinkText": "Książka bankowa",
+    "FinLogLinkText": "Książka finansowa",
+    "FormButtonClass": "btn btn-sm btn-success",
+    "LogoutLinkText": "Wyloguj się",
+    "NextPageRel": "next",
+    "ErrorsID": "error_explanation",
+}
+
+# Table of entries on the logbook page, read to find already imported records
+LogbookTable = {
+    "Rows": "table tbody tr",                                       # CSS selector of entry rows
+    "DocNrAfterDate": 1,                                            # position of the document nr cell, relative to the date cell
+    "NextPageLink": (By.CSS_SELECTOR, "ul.pagination a[rel='next']"),
+}
@@ -0,0 +1,128 @@
+# Regression tests of the HTTP engine against the local mock of ZiHeR
+# Author: Marek Szymański
+
+import json
+import random
+
+import pytest
+
+from benchmark import make_workbook
+from mock_ziher import MockZiher
+from ziher_http import ZiherPlusHTTP
+
+ROWS = 8
+FIRST_ROW = 2
+LOGBOOK = "bankowa"
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = str(tmp_path / "dane.xlsx")
+    make_workbook(path, ROWS)
+    return path
+
+
+@pytest.fixture
+def mock():
+    random.seed(0)
+    with MockZiher() as mock:
+        yield mock
+
+
+def entries(mock: MockZiher) -> list[dict]:
+    return [e for journal in mock.entries.values() for e in journal]
+
+
+def driver(mock: MockZiher, workbook: str, **kwargs) -> ZiherPlusHTTP:
+    '''Signed in HTTP engine with the `workbook` loaded, retrying right away'''
+    kwargs = {"human_control": False, "backoff": 0.01, **kwargs}
+    zp = ZiherPlusHTTP.Session(base_url=mock.url, **kwargs)
+    return zp.login("test@zhr.pl", "haslo", "pomorze").load(workbook, "dane")
+
+
+def expire_before_commit(zp: ZiherPlusHTTP, mock: MockZiher, nr: int) -> None:
+    '''Makes ZiHeR sign `zp` out right before its `nr`-th commit'''
+    commit, count = zp._commit, [0]
+
+    def expiring_commit():
+        count[0] += 1
+        if count[0] == nr:
+            mock.expire_sessions()
+        commit()
+    zp._commit = expiring_commit
+
+
+def test_login_and_send(mock, workbook):
+    zp = driver(mock, workbook)
+    zp.send(LOGBOOK, FIRST_ROW)
+
+    assert [r["status"] for r in zp.report] == ["sent"] * ROWS
+    assert [r["IDX"] for r in zp.report] == list(range(1, ROWS + 1))
+    assert [e["name"] for e in entries(mock)] == [f"Rekord testowy {i}" for i in range(1, ROWS + 1)]
+    zp.logout().quit()
+
+
+def test_journal_skips_commited_records(mock, workbook, tmp_path):
+    journal = str(tmp_path / "journal.jsonl")
+    driver(mock, workbook, journal=journal).send(LOGBOOK, FIRST_ROW, FIRST_ROW + 2)
+
+    zp = driver(mock, workbook, journal=journal).send(LOGBOOK, FIRST_ROW)
+    assert [r["IDX"] for r in zp.report] == list(range(4, ROWS + 1))
+    assert len(entries(mock)) == ROWS
+    with open(journal, encoding="utf-8") as f:
+        assert sorted(json.loads(line)["IDX"] for line in f) == list(range(1, ROWS + 1))
+
+
+def test_skip_existing_reads_the_logbook(mock, workbook):
+    mock.page_size = 3  # the index has to go through several pages
+    driver(mock, workbook).send(LOGBOOK, FIRST_ROW, FIRST_ROW + 4)
+
+    zp = driver(mock, workbook).send(LOGBOOK, FIRST_ROW, skip_existing=True)
+    assert [r["IDX"] for r in zp.report] == list(range(6, ROWS + 1))
+    assert len(entries(mock)) == ROWS
+
+
+def test_server_errors_are_retried_without_duplicates(mock, workbook):
+    zp = driver(mock, workbook, retries=5)
+    mock.error_rate = 0.2
+    zp.send(LOGBOOK, FIRST_ROW)
+    mock.error_rate = 0
+
+    sent = [r["IDX"] for r in zp.report if r["status"] == "sent"]
+    assert len(zp.report) == ROWS
+    assert len(sent) + len(zp.gave_up) == ROWS
+    assert sorted(e["name"] for e in entries(mock)) == sorted(f"Rekord testowy {i}" for i in sent)
+
+
+def test_expired_session_at_commit_is_retried(mock, workbook, tmp_path):
+    journal = str(tmp_path / "journal.jsonl")
+    zp = driver(mock, workbook, journal=journal)
+    expire_before_commit(zp, mock, 3)
+    zp.send(LOGBOOK, FIRST_ROW)
+
+    assert [r["status"] for r in zp.report] == ["sent"] * ROWS
+    assert zp.report[2]["attempts"] == 2
+    assert len(entries(mock)) == ROWS
+    with open(journal, encoding="utf-8") as f:
+        assert len(f.readlines()) == ROWS
+
+
+def test_expired_session_before_send_signs_in_again(mock, workbook):
+    zp = driver(mock, workbook)
+    mock.expire_sessions()
+    zp.send(LOGBOOK, FIRST_ROW)
+
+    assert [r["status"] for r in zp.report] == ["sent"] * ROWS
+    assert len(entries(mock)) == ROWS
+
+
+def test_prefetch_mode_retries_and_reports_every_record(mock, workbook, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda prompt="": "y")
+    monkeypatch.setattr("builtins.print", lambda *args, **kwargs: None)
+    zp = driver(mock, workbook, human_control=True, prefetch=True)
+    expire_before_commit(zp, mock, 2)
+    zp.send(LOGBOOK, FIRST_ROW)
+
+    assert [r["IDX"] for r in zp.report] == list(range(1, ROWS + 1))
+    assert [r["status"] for r in zp.report] == ["sent"] * ROWS
+    assert len(entries(mock)) == ROWS
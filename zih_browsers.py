@@ -0,0 +1,70 @@
+# Browser setup for ZiherPlus - default and lean, fast-loading profiles
+# Author: Marek Szymański
+
+import os
+from typing import Callable, Optional
+
+from selenium import webdriver
+from selenium.webdriver.remote.webdriver import WebDriver
+
+# resources ZiHeR's forms and logbooks work without, blocked in the fast profile
+BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.svg", "*.ico", "*.webp",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp3", "*.mp4", "*.webm",
+]
+
+
+def chrome(fast: bool = False, headless: bool = False, profile_dir: Optional[str] = None) -> WebDriver:
+    '''Starts Chrome
+
+    :param fast: lean profile - images, fonts and media are not downloaded and pages count as loaded
+                 once their HTML is parsed ("eager" page load strategy), without waiting for the rest
+    :param headless: run without a window
+    :param profile_dir: browser profile directory to reuse between runs (cache, cookies),
+                        can't be used by two browsers at once
+    '''
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument("--headless=new")
+    if profile_dir:
+        options.add_argument(f"--user-data-dir={os.path.abspath(profile_dir)}")
+    if fast:
+        options.page_load_strategy = "eager"
+        options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+        for arg in ["--blink-settings=imagesEnabled=false", "--disable-extensions", "--no-first-run",
+                    "--disable-background-networking", "--disable-sync", "--mute-audio"]:
+            options.add_argument(arg)
+
+    driver = webdriver.Chrome(options=options)
+    if fast:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+    return driver
+
+
+def firefox(fast: bool = False, headless: bool = False, profile_dir: Optional[str] = None) -> WebDriver:
+    '''Starts Firefox, parameters as in `chrome`'''
+    options = webdriver.FirefoxOptions()
+    if headless:
+        options.add_argument("-headless")
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        options.add_argument("-profile")
+        options.add_argument(os.path.abspath(profile_dir))
+    if fast:
+        options.page_load_strategy = "eager"
+        options.set_preference("permissions.default.image", 2)
+        options.set_preference("browser.display.use_document_fonts", 0)
+        options.set_preference("media.autoplay.default", 5)
+        options.set_preference("network.prefetch-next", False)
+        options.set_preference("network.dns.disablePrefetch", True)
+        options.set_preference("browser.shell.checkDefaultBrowser", False)
+    return webdriver.Firefox(options=options)
+
+
+'''Browsers with a fast profile, by name'''
+BROWSERS: dict[str, Callable[..., WebDriver]] = {
+    "chrome": chrome,
+    "firefox": firefox,
+}
@@ -0,0 +1,55 @@
+# Exceptions raised by ZiherPlus
+# Author: Marek Szymański
+
+
+class ZiherError(Exception):
+    '''Base class for errors reported by ZiherPlus'''
+
+
+class LoginError(ZiherError):
+    '''ZiHeR did not accept the credentials or the login page could not be used'''
+
+
+class MissingFieldsError(ZiherError):
+    '''Some of the record's fields have no matching input on the form
+
+    :ivar fields: ids of the missing inputs
+    '''
+    def __init__(self, fields: list[str]):
+        super().__init__(f"Missing form fields: {', '.join(fields)}")
+        self.fields = fields
+
+
+class InvalidRecordError(ZiherError):
+    '''The record read from the spreadsheet can't be sent as it is, see `row_to_record`
+
+    :ivar problem: what's wrong with the record
+    '''
+    def __init__(self, problem: str):
+        super().__init__(f"Invalid record: {problem}")
+        self.problem = problem
+
+
+class EntryRejectedError(ZiherError):
+    '''ZiHeR showed the form back instead of saving the entry
+
+    :ivar messages: validation errors shown with the form
+    '''
+    def __init__(self, messages: list[str], url: str):
+        details = f": {'; '.join(messages)}" if messages else ""
+        super().__init__(f"ZiHeR did not accept the entry, still on {url}{details}")
+        self.messages = messages
+
+
+'''Kinds of failed records told apart by ZiherPlus, with whether trying again may help'''
+FAILURE_KINDS = {
+    "stale": True,      # page changed under the driver while it was used
+    "timeout": True,    # page or element didn't show up in time
+    "session": True,    # ZiHeR signed the driver out
+    "network": True,    # connection failed or ZiHeR answered with a server error
+    "rejected": False,  # ZiHeR showed the form back with validation errors
+    "uncertain": False, # commit failed after it was sent, the entry may be saved - check the logbook
+    "fields": False,    # record's fields don't match the form
+    "invalid": False,   # record itself can't be sent, e.g. a 1% amount with no cost item to belong to
+    "other": False,
+}
@@ -0,0 +1,103 @@
+# Index of entries already present in a ZiHeR logbook
+# Author: Marek Szymański
+
+import datetime
+import re
+from typing import Generator, Iterable, Optional
+
+from site_specific import FormFieldIDs, LogbookTable
+from zih_types import ZihRecord
+
+DATE_FORMATS = ["%Y-%m-%d", "%d.%m.%Y", "%d-%m-%Y", "%d/%m/%Y"]
+AMOUNT_FIELD = re.compile(r"^entry_items_attributes_\d+_amount$")
+
+
+def parse_date(value) -> Optional[str]:
+    '''Normalizes a date cell or record value to Y-m-d, None if it's not a date'''
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.strftime("%Y-%m-%d")
+    text = str(value).strip()[:10]
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+def parse_amount(value) -> Optional[float]:
+    '''Reads a monetary value - a number or text like "1 234,50 zł", None if it's not one'''
+    if isinstance(value, (int, float)):
+        return round(float(value), 2)
+    text = re.sub(r"[\s ]|zł", "", str(value)).replace(",", ".")
+    try:
+        return round(float(text), 2)
+    except ValueError:
+        return None
+
+
+def record_key(record: ZihRecord) -> tuple[Optional[str], str]:
+    '''Date and document number of the `record`, normalized for comparisons'''
+    doc_nr = str(record.get(FormFieldIDs['doc_nr'], ""))
+    return parse_date(record.get(FormFieldIDs['date'], "")), " ".join(doc_nr.split()).casefold()
+
+
+def record_total(record: ZihRecord) -> Optional[float]:
+    '''Sum of all item amounts of the `record`'''
+    amounts = [parse_amount(v) for k, v in record.items() if AMOUNT_FIELD.match(k)]
+    if any(a is None for a in amounts):
+        return None
+    return round(sum(amounts), 2)
+
+
+class EntryIndex:
+    '''Entries found in a logbook, keyed by date and document number
+
+    Built from the rows of the logbook table, without assuming the layout of the amount
+    columns: every monetary value in an entry's row is remembered, and a record matches
+    the entry when its total amount is one of them.
+
+    :ivar skipped: number of records left out by the last `missing` call
+    '''
+
+    def __init__(self, rows: Iterable[list[str]] = ()):
+        self.skipped = 0
+        self.__entries = {}
+        for cells in rows:
+            self.add_row(cells)
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self.__entries.values())
+
+    def add_row(self, cells: list[str]) -> bool:
+        '''Adds the entry from the texts of a logbook table row, if it has a date
+
+        :returns: was the row recognized as an entry
+        '''
+        for i, cell in enumerate(cells):
+            date = parse_date(cell)
+            if date is not None:
+                break
+        else:
+            return False
+
+        doc_pos = i + LogbookTable["DocNrAfterDate"]
+        doc_nr = cells[doc_pos] if doc_pos < len(cells) else ""
+        amounts = {parse_amount(c) for c in cells[doc_pos + 1:]} - {None}
+        key = (date, " ".join(doc_nr.split()).casefold())
+        self.__entries.setdefault(key, []).append(amounts)
+        return True
+
+    def contains(self, record: ZihRecord) -> bool:
+        '''Is there an entry with the same date, document number and amount as the `record`'''
+        total = record_total(record)
+        return any(total in amounts for amounts in self.__entries.get(record_key(record), []))
+
+    def missing(self, records: Iterable[ZihRecord]) -> Generator[ZihRecord, None, None]:
+        '''Filters out `records` already in the index, counting them in `skipped`'''
+        self.skipped = 0
+        for record in records:
+            if self.contains(record):
+                self.skipped += 1
+            else:
+                yield record
@@ -0,0 +1,198 @@
+# Batch importing of many workbooks, sheets and logbooks in one ZiherPlus session
+# Author: Marek Szymański
+
+import argparse
+import getpass
+import json
+import os
+import time
+from typing import Optional
+try:
+    import tomllib
+except ImportError:  # Python < 3.11, only JSON manifests then
+    tomllib = None
+
+from ziher_http import ZiherPlusHTTP
+from ziher_plus import ZiherPlus, ZiherPlusSafeMode
+
+ENGINES = {
+    "chrome": ZiherPlus.Chrome,
+    "firefox": ZiherPlus.Firefox,
+    "edge": ZiherPlus.Edge,
+    "safari": ZiherPlus.Safari,
+    "http": ZiherPlusHTTP.Session,
+    "safe-chrome": ZiherPlusSafeMode.Chrome,
+    "safe-firefox": ZiherPlusSafeMode.Firefox,
+}
+
+'''Keys of a single job, with their defaults - None marks the required ones'''
+JOB_KEYS = {
+    "name": "",
+    "file": None,
+    "sheet": None,
+    "logbook": None,
+    "min_row": None,
+    "max_row": None,
+    "skip_existing": False,
+    "validate": True,
+}
+REQUIRED_JOB_KEYS = ["file", "logbook", "min_row"]
+
+
+def load_manifest(path: str) -> dict:
+    '''Reads the job manifest - a .json or .toml file like this one:
+
+        email = "jan.kowal@zhr.pl"            # optional, account and region
+        region = "pomorze"                    # can also be given on the command line
+        engine = "chrome"                     # optional, one of ENGINES
+        human_control = false                 # optional, default true
+        options = { journal = "import.jsonl" } # optional, other ZiherPlus arguments
+
+        [defaults]                            # optional, shared by all jobs
+        sheet = "2024"
+        logbook = "bankowa"
+
+        [[jobs]]
+        name = "1 DH"
+        file = "1dh.xlsx"                     # relative to the manifest
+        min_row = 5
+        max_row = 120                         # optional, default - until the end of data
+
+        [[jobs]]
+        file = "1dh.xlsx"
+        logbook = "finansowa"
+        min_row = 5
+        skip_existing = true
+
+    :param path: path to the manifest
+
+    :raises ValueError: when a job has unknown keys or lacks required ones
+
+    :returns: the manifest, with defaults applied to each of its "jobs"
+              and their files resolved relative to the manifest
+    '''
+    if path.lower().endswith(".toml"):
+        if tomllib is None:
+            raise RuntimeError("TOML manifests need Python 3.11 or newer, use JSON instead")
+        with open(path, "rb") as f:
+            manifest = tomllib.load(f)
+    else:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    base = os.path.dirname(os.path.abspath(path))
+    defaults = manifest.get("defaults", {})
+    jobs = []
+    for nr, job in enumerate(manifest.get("jobs", []), 1):
+        job = {**JOB_KEYS, **defaults, **job}
+        unknown = set(job) - set(JOB_KEYS)
+        if unknown:
+            raise ValueError(f"job {nr}: unknown keys {sorted(unknown)}")
+        missing = [k for k in REQUIRED_JOB_KEYS if job[k] is None]
+        if missing:
+            raise ValueError(f"job {nr}: missing {missing}")
+        job["file"] = os.path.join(base, job["file"])
+        job["name"] = job["name"] or f"{os.path.basename(job['file'])}:{job['sheet'] or ''} -> {job['logbook']}"
+        jobs.append(job)
+
+    manifest["jobs"] = jobs
+    return manifest
+
+
+def run_jobs(zp: ZiherPlus, jobs: list[dict]) -> list[dict]:
+    '''Works through `jobs` one after another with the already logged-in `zp`
+
+    A failing job doesn't stop the others - its error is reported and the next one starts.
+    Workbooks are loaded once and reused by all jobs using them, see `ZiherPlus.load`.
+
+    :param zp: logged-in driver, ZiherPlus or any of its subclasses
+    :param jobs: jobs as in the manifest returned by `load_manifest`
+
+    :returns: outcome of each job: {"name", "status", "records", "sent", "failed",
+              "skipped", "elapsed", "records/min", "error", "report"},
+              where status is "done", "invalid" (validation errors, nothing sent) or "error"
+    '''
+    results = []
+    for nr, job in enumerate(jobs, 1):
+        print(f"=== JOB {nr}/{len(jobs)}: {job['name']} ===")
+        result = {"name": job["name"], "status": "done", "error": None}
+        started = time.perf_counter()
+        zp.report = []
+        try:
+            zp.load(job["file"], job["sheet"])
+            issues = zp.validate(job["min_row"], job["max_row"]) if job["validate"] else []
+            if any(x["level"] == "error" for x in issues):
+                result["status"] = "invalid"
+            else:
+                zp.send(job["logbook"], job["min_row"], job["max_row"],
+                        skip_existing=job["skip_existing"], validate=False)
+        except Exception as err:
+            print(f"Job failed: {type(err).__name__}: {err}")
+            result["status"] = "error"
+            result["error"] = f"{type(err).__name__}: {err}"
+
+        elapsed = time.perf_counter() - started
+        statuses = [r["status"] for r in zp.report]
+        result.update({
+            "records": len(statuses),
+            "sent": statuses.count("sent"),
+            "failed": statuses.count("failed"),
+            "skipped": statuses.count("skipped"),
+            "elapsed": round(elapsed, 2),
+            "records/min": round(60 * len(statuses) / elapsed, 1) if elapsed else 0.0,
+            "report": list(zp.report),
+        })
+        results.append(result)
+    return results
+
+
+def print_jobs_report(results: list[dict]) -> None:
+    '''Prints the outcome of each job of `run_jobs` as a table, failed records listed below it'''
+    columns = ["name", "status", "records", "sent", "failed", "skipped", "elapsed", "records/min"]
+    cells = [[str(r[c]) for c in columns] for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in cells)) for i, c in enumerate(columns)]
+    print(" | ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    print("-+-".join("-" * w for w in widths))
+    for row in cells:
+        print(" | ".join(c.ljust(w) for c, w in zip(row, widths)))
+
+    for r in results:
+        if r["error"]:
+            print(f"{r['name']}: {r['error']}")
+        for x in r["report"]:
+            if x["status"] == "failed":
+                print(f"{r['name']}: record {x['IDX']} failed: {x['error']}")
+
+
+def main(argv: Optional[list[str]] = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description="Run all import jobs of a manifest in one ZiherPlus session")
+    parser.add_argument("manifest", help="job manifest, .json or .toml")
+    parser.add_argument("--engine", choices=list(ENGINES), help="overrides the manifest's engine")
+    parser.add_argument("--email", help="overrides the manifest's email")
+    parser.add_argument("--region", help="overrides the manifest's region")
+    parser.add_argument("--base-url", help="address of the ZiHeR instance, e.g. of mock_ziher.py")
+    args = parser.parse_args(argv)
+
+    manifest = load_manifest(args.manifest)
+    email = args.email or manifest.get("email") or input("email: ")
+    region = args.region or manifest.get("region", "pomorze")
+    password = os.environ.get("ZIHER_PASSWORD") or getpass.getpass(f"password for {email}: ")
+    options = dict(manifest.get("options", {}))
+    if args.base_url:
+        options["base_url"] = args.base_url
+
+    engine = ENGINES[args.engine or manifest.get("engine", "chrome")]
+    zp = engine(human_control=manifest.get("human_control", True), **options)
+    try:
+        zp.login(email, password, region)
+        results = run_jobs(zp, manifest["jobs"])
+        zp.logout()
+    finally:
+        zp.quit()
+
+    print_jobs_report(results)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Journal of imported records, letting interrupted imports resume
+# Author: Marek Szymański
+
+import json
+import os
+import threading
+import time
+from typing import Generator, Iterable
+
+from zih_loader import record_hash
+from zih_types import ZihRecord
+
+
+class ImportJournal:
+    '''Append-only JSON lines file with every record commited to ZiHeR
+
+    Each line is written and flushed to disk right after the commit, so after a crash
+    the journal still lists everything that got through. A record is identified by
+    the workbook, the worksheet, its number ("IDX") and a hash of its content -
+    if the row is edited in the spreadsheet it's no longer considered imported.
+
+    :param path: journal file, created if it doesn't exist
+
+    :ivar path: journal file
+    :ivar skipped: number of records left out by the last `pending` call
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.skipped = 0
+        self.__lock = threading.Lock()
+        self.__done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # line cut short by a crash
+                    self.__done.add(self.__key(entry["workbook"], entry["sheet"], entry["IDX"], entry["hash"]))
+
+    def is_commited(self, workbook: str, sheet: str, record: ZihRecord) -> bool:
+        '''Is the `record` from `sheet` of `workbook` already in the journal'''
+        return self.__key(workbook, sheet, record.get("IDX"), record_hash(record)) in self.__done
+
+    def pending(
+        self, workbook: str, sheet: str, records: Iterable[ZihRecord]
+    ) -> Generator[ZihRecord, None, None]:
+        '''Filters out `records` already in the journal, counting them in `skipped`'''
+        self.skipped = 0
+        for record in records:
+            if self.is_commited(workbook, sheet, record):
+                self.skipped += 1
+            else:
+                yield record
+
+    def add(self, workbook: str, sheet: str, record: ZihRecord) -> None:
+        '''Appends the `record` from `sheet` of `workbook` to the journal'''
+        entry = {
+            "workbook": os.path.abspath(workbook),
+            "sheet": sheet,
+            "IDX": record.get("IDX"),
+            "hash": record_hash(record),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with self.__lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, default=str, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.__done.add(self.__key(workbook, sheet, entry["IDX"], entry["hash"]))
+
+    @staticmethod
+    def __key(workbook: str, sheet: str, idx, hash: str) -> tuple:
+        return (os.path.abspath(workbook), sheet, str(idx), hash)
@@ -5,12 +5,16 @@ import openpyxl
 from openpyxl import Workbook
 from openpyxl.worksheet.worksheet import Worksheet
 import datetime
+import hashlib
+import json
+import os
 from typing import Generator, Optional
 
 
 from zih_types import ZihRecord
 from site_specific import FormFieldIDs
 from excel_specific import COLS
+from zih_sources import CachedWorkbook, iter_values, load_csv, load_ods
 
 
 def print_record(record: ZihRecord, nr: Optional[int]) -> None:
@@ -25,61 +29,144 @@ def print_record(record: ZihRecord, nr: Optional[int]) -> None:
         print(k + ": " + str(v))
     print()
 
+# columns read from each row and the one telling whether the row holds a record
+LAST_COL = max(COLS)
+IDX_COL = next(k for k, v in COLS.items() if v["id"] == "IDX")
+# key of the problems with a record which make it impossible to send, see `row_to_record`
+ERROR_KEY = "error"
+
+
+def record_hash(record: ZihRecord) -> str:
+    '''Short fingerprint of the `record`'s content, changes whenever any of its values does'''
+    dump = json.dumps(record, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(dump.encode()).hexdigest()[:16]
+
 def iter_data(
-    ws: Worksheet, min_row: int, max_row: int
+    ws: Worksheet, min_row: int, max_row: Optional[int] = None
 ) -> Generator[ZihRecord, None, None]:
     '''Iterates over rows in worksheet `ws` from `min_row` to `max_row`
+
+    Reads cell values only, row by row, so it streams through worksheets
+    loaded with `load_workbook(..., streaming=True)` without keeping them in memory.
     
     :param ws: Excel worksheet to iterate over
     :param min_row: first row of record data
-    :param max_row: last  row of record data
+    :param max_row: last  row of record data, leave out to stop at the
+                    first row without the record number (the end of data)
 
     :returns: yields dicts containing input_ids, respective input values
               and other info about each record from each row between `min_row` and `max_row`
               {
                 "type": record typ - either "income" or "cost",
-                "category": category of the record - as in COLS,
+                "category": categories of the record - names from COLS, comma separated,
                 "IDX": index of the record in the Excel file
                 "date": record date, in Y-m-d format
                 id of form input, specific to record category and type: monetary value (income or cost)
                 ...
+                id of 1% / grant input of a cost item: part of its amount financed that way
+                ...
+                ERROR_KEY: what makes the record impossible to send - only if anything does
               }
     '''
-    for row in ws.iter_rows(min_row=min_row, max_row=max_row):
-        entry = {}
-        for k, v in COLS.items():
-            k -= 1
-            if not row[k].value:
-                continue
+    for row in iter_values(ws, min_row, max_row, LAST_COL):
+        if max_row is None and (len(row) < IDX_COL or not row[IDX_COL - 1]):
+            return
+
+        yield row_to_record(row)
+
+def row_to_record(row: tuple) -> ZihRecord:
+    '''Maps values of a single spreadsheet row onto form inputs, as described in COLS
+
+    A row with amounts in several income (or cost) columns becomes one entry
+    with an item for each of them, its "category" lists all their names.
+
+    :param row: cell values of the row, starting with the first column
+
+    A 1% or grant amount which can't be assigned to a cost item (its column has no "id"
+    and the row doesn't have exactly one cost amount) is described under ERROR_KEY instead -
+    the record then fails on its own when sent, without stopping the iteration.
+    `validate_range` reports such rows beforehand.
 
-            if v["type"] == "misc":
-                if v["name"] == "data":
-                    if (isinstance(row[k].value, datetime.datetime)):
-                        entry[v["id"]] = str(row[k].value.strftime("%Y-%m-%d"))
-                    else:
-                        entry[v["id"]] = row[k].value
+    :returns: dict with the record, as yielded by `iter_data`
+    '''
+    entry = {}
+    categories = []
+    cost_items = []
+    shares = []
+    for k, v in COLS.items():
+        k -= 1
+        if k >= len(row) or not row[k]:
+            continue
+
+        if v["type"] == "misc":
+            if v["name"] == "data":
+                if (isinstance(row[k], datetime.datetime)):
+                    entry[v["id"]] = str(row[k].strftime("%Y-%m-%d"))
                 else:
-                    entry[v["id"]] = row[k].value
-            elif v["type"] in ["income", "cost"]:
-                entry[FormFieldIDs['amountFun'](v['id'])] = row[k].value
-                entry["type"] = v["type"]
-                entry["category"] = v["name"]
+                    entry[v["id"]] = row[k]
+            else:
+                entry[v["id"]] = row[k]
+        elif v["type"] in ["income", "cost"]:
+            entry[FormFieldIDs['amountFun'](v['id'])] = row[k]
+            entry["type"] = v["type"]
+            categories.append(v["name"])
+            if v["type"] == "cost":
+                cost_items.append(v["id"])
+        elif v["type"] in ["onep", "grant"]:
+            shares.append((v, row[k]))
 
-        yield entry
+    problems = []
+    for v, amount in shares:
+        idx = v["id"]
+        if idx is None:
+            if len(cost_items) != 1:
+                problems.append(f"'{v['name']}' needs exactly one cost amount in the row to belong to")
+                continue
+            idx = cost_items[0]
+        entry[FormFieldIDs[f"{v['type']}Fun"](idx)] = amount
+    if problems:
+        entry[ERROR_KEY] = "; ".join(problems)
+
+    if categories:
+        entry["category"] = ", ".join(categories)
+    return entry
 
 def load_workbook(
-    filename: str, sheetname: Optional[str] = None
+    filename: str, sheetname: Optional[str] = None, streaming: bool = False, cache: Optional[str] = None
 ) -> tuple[Workbook, Worksheet]:
     '''Loads Excel workbook pointed to by `filename` and from it either the worksheet `sheetname` or the active worksheet
+
+    Files ending in .csv and .ods are read from CSV and OpenDocument exports instead (see zih_sources.py),
+    the returned workbook and worksheet then provide only what ZiherPlus needs from openpyxl's ones.
     
-    :param filename: path to Excel file to load
+    :param filename: path to Excel (or CSV/ODS) file to load
     :param sheetname: sheetname to load from the workbook, leave out to load active worksheet
+    :param streaming: open the workbook read-only - sheets are then parsed lazily, row by row,
+                      when iterated over, and formulas are read as their last computed values.
+                      Such workbook has to be closed after use.
+    :param cache: directory for caching parsed sheets - as long as the file is unchanged,
+                  each sheet is parsed only once, later loads read its rows from the cache
 
     :returns: tuple of loaded workbook and loaded worksheet
     '''
-    wb = openpyxl.load_workbook(filename)
-    ws = wb[sheetname] if sheetname else wb.active
-    return wb, ws
+    if cache:
+        wb = CachedWorkbook(filename, cache, lambda: open_workbook(filename, streaming=True))
+    else:
+        wb = open_workbook(filename, streaming)
+    return wb, load_worksheet(wb, sheetname)
+
+def open_workbook(filename: str, streaming: bool = False) -> Workbook:
+    '''Opens the workbook `filename`, picking the reader by the file's extension
+
+    :param filename: path to .xlsx, .csv or .ods file
+    :param streaming: open Excel workbooks read-only, see `load_workbook`
+    '''
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == ".csv":
+        return load_csv(filename)
+    if ext == ".ods":
+        return load_ods(filename)
+    return openpyxl.load_workbook(filename, read_only=streaming, data_only=streaming)
 
 def load_worksheet(wb: Workbook, sheetname: str) -> Worksheet:
     '''Wrapper for loading worksheet `sheetname` from workbook `wb`
@@ -89,4 +176,7 @@ def load_worksheet(wb: Workbook, sheetname: str) -> Worksheet:
 
     :returns: loaded worksheet `sheetname`
     '''
-    return wb[sheetname]
+    ws = wb[sheetname] if sheetname else wb.active
+    if wb.read_only:
+        ws.reset_dimensions()  # don't trust the stored sheet size, data ends where records end
+    return ws
@@ -0,0 +1,168 @@
+# Timing of ZiherPlus runs, stage by stage
+# Author: Marek Szymański
+
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional, TextIO, Union
+
+from zih_types import ZihRecord
+
+
+def percentile(values: list[float], p: float) -> float:
+    '''`p`-th percentile of already sorted `values`, nearest-rank method'''
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return values[rank]
+
+
+class RunMetrics:
+    '''Collects how long each stage of each record takes and reports it as JSON lines events
+
+    Events are dicts with "event" and "time" keys, written one per line to `sink`
+    and passed to every callback:
+    - "run_start", "run_end" (with the `summary`) - once per `send`,
+    - "record" - once per attempt of a record, with its "IDX", "status", "duration" and "stages" timings,
+      attempts to be tried again have status "retry" and count only as `retries`, not as records,
+    - "stage" - once per stage of a record, only with `stage_events`.
+    Timing is a couple of `perf_counter` calls per stage, cheap enough to leave on.
+    Safe to share between the drivers of a ZiherPlusPool.
+
+    :param sink: path of the JSON lines file to append events to, or an open text stream
+    :param callbacks: functions called with every event
+    :param stage_events: emit an event for every stage, not only for every record
+    '''
+
+    def __init__(
+        self,
+        sink: Union[str, TextIO, None] = None,
+        callbacks: Iterable[Callable[[dict], None]] = (),
+        stage_events: bool = False,
+    ):
+        self.__sink = open(sink, "a", encoding="utf-8") if isinstance(sink, str) else sink
+        self.__owns_sink = isinstance(sink, str)
+        self.__callbacks = list(callbacks)
+        self.__stage_events = stage_events
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        '''Forgets collected timings'''
+        with self.__lock:
+            self.__started = time.perf_counter()
+            self.__durations = {}  # stage -> list of seconds
+            self.__statuses = {}
+            self.__records = 0
+            self.__retries = 0
+
+    def emit(self, event: str, **data) -> dict:
+        '''Sends event `event` with `data` to the sink and the callbacks'''
+        data = {"event": event, "time": round(time.time(), 3), **data}
+        with self.__lock:
+            if self.__sink:
+                self.__sink.write(json.dumps(data, default=str, ensure_ascii=False) + "\n")
+                self.__sink.flush()
+        for callback in self.__callbacks:
+            callback(data)
+        return data
+
+    def start_run(self, **data) -> None:
+        '''Marks the start of a `send`, resets the timings'''
+        self.reset()
+        self.emit("run_start", **data)
+
+    def end_run(self, **data) -> dict:
+        '''Marks the end of a `send`, emits and returns the `summary`'''
+        summary = self.summary()
+        self.emit("run_end", **data, summary=summary)
+        return summary
+
+    def start_record(self, record: ZihRecord, nr: Optional[int] = None) -> None:
+        '''Starts timing the `record` handled by the current thread'''
+        self.__local.record = {"IDX": record.get("IDX"), "nr": nr, "stages": {}}
+        self.__local.started = time.perf_counter()
+
+    def end_record(self, status: str, error: Optional[str] = None) -> None:
+        '''Ends timing the current thread's record, with its outcome - "retry" ends just the attempt'''
+        current = getattr(self.__local, "record", None)
+        if current is None:
+            return
+        duration = time.perf_counter() - self.__local.started
+        self.__local.record = None
+        with self.__lock:
+            if status == "retry":
+                self.__retries += 1
+                self.__durations.setdefault("retried", []).append(duration)
+            else:
+                self.__records += 1
+                self.__statuses[status] = self.__statuses.get(status, 0) + 1
+                self.__durations.setdefault("record", []).append(duration)
+        self.emit("record", **current, status=status, error=error, duration=round(duration, 4))
+
+    @contextmanager
+    def stage(self, name: str):
+        '''Times the code inside the `with` block as stage `name` of the current record'''
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name: str, duration: float) -> None:
+        '''Records `duration` seconds spent in stage `name` of the current record'''
+        with self.__lock:
+            self.__durations.setdefault(name, []).append(duration)
+        current = getattr(self.__local, "record", None)
+        if current is not None:
+            current["stages"][name] = round(current["stages"].get(name, 0) + duration, 4)
+        if self.__stage_events:
+            self.emit("stage", stage=name, IDX=current and current["IDX"], duration=round(duration, 4))
+
+    def summary(self) -> dict:
+        '''Counts, throughput and p50/p95/max of each stage since the last reset
+
+        "records" counts final outcomes only, attempts tried again are counted in "retries"
+        and timed as stage "retried".
+        '''
+        with self.__lock:
+            elapsed = time.perf_counter() - self.__started
+            stages = {}
+            for name, values in self.__durations.items():
+                values = sorted(values)
+                stages[name] = {
+                    "count": len(values),
+                    "total": round(sum(values), 3),
+                    "p50": round(percentile(values, 50), 4),
+                    "p95": round(percentile(values, 95), 4),
+                    "max": round(values[-1], 4),
+                }
+            return {
+                "records": self.__records,
+                "statuses": dict(self.__statuses),
+                "retries": self.__retries,
+                "elapsed": round(elapsed, 3),
+                "records_per_min": round(60 * self.__records / elapsed, 1) if elapsed else 0.0,
+                "stages": stages,
+            }
+
+    def print_summary(self, summary: Optional[dict] = None) -> None:
+        '''Prints the `summary` (by default the current one) as a table'''
+        summary = summary or self.summary()
+        statuses = ", ".join(f"{k}: {v}" for k, v in summary["statuses"].items())
+        if summary.get("retries"):
+            statuses += f", retries: {summary['retries']}"
+        print(f"{summary['records']} records in {summary['elapsed']:.1f} s "
+              f"({summary['records_per_min']:.1f} records/min) - {statuses}")
+        print(f"{'stage':<12} {'count':>6} {'total [s]':>10} {'p50 [s]':>8} {'p95 [s]':>8} {'max [s]':>8}")
+        for name, s in summary["stages"].items():
+            print(f"{name:<12} {s['count']:>6} {s['total']:>10.2f} {s['p50']:>8.3f} {s['p95']:>8.3f} {s['max']:>8.3f}")
+
+    def close(self) -> None:
+        '''Closes the sink file, if it was opened from a path'''
+        if self.__owns_sink and self.__sink:
+            self.__sink.close()
+            self.__sink = None
@@ -0,0 +1,113 @@
+# Adaptive pacing of record submissions, following how ZiHeR copes with the load
+# Author: Marek Szymański
+
+import threading
+import time
+from typing import Optional
+
+'''Kinds of failures (see FAILURE_KINDS in zih_errors.py) which suggest ZiHeR is overloaded'''
+OVERLOAD_KINDS = {"timeout", "network", "stale", "uncertain"}
+
+
+class AdaptivePacer:
+    '''Delay between record submissions, adjusted to ZiHeR's measured latency and failures
+
+    After every record the delay is adjusted:
+    - failure of one of OVERLOAD_KINDS - multiplied by `backoff`, starting from at least the usual latency,
+    - commit slower than `slow_factor` times the usual latency - increased by the usual latency,
+    - healthy commit - multiplied by `recovery`,
+    always staying between `min_delay` and `max_delay`.
+    The usual latency is a moving average of the commits' latencies, slow ones weighing little,
+    so the pace scales with ZiHeR's speed - a hiccup of a fast server costs milliseconds, not seconds.
+    Safe to share between the drivers of a ZiherPlusPool - they then pace together.
+
+    :param min_delay: shortest delay between submissions, in seconds
+    :param max_delay: longest delay between submissions, in seconds
+    :param initial: delay to start with
+    :param step: stands for the usual latency until the first commit is measured
+    :param backoff: multiplier of the delay after a failure
+    :param recovery: multiplier of the delay after a healthy commit
+    :param slow_factor: how many times the usual latency a commit must take to count as slow
+
+    :ivar delay: current delay, in seconds
+    '''
+
+    def __init__(
+        self,
+        min_delay: float = 0.0,
+        max_delay: float = 10.0,
+        initial: float = 0.0,
+        step: float = 0.25,
+        backoff: float = 2.0,
+        recovery: float = 0.8,
+        slow_factor: float = 3.0,
+    ):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.step = step
+        self.backoff = backoff
+        self.recovery = recovery
+        self.slow_factor = slow_factor
+        self.delay = min(max(initial, min_delay), max_delay)
+        self.__latency = None  # usual commit latency
+        self.__last = 0.0  # when the last submission was allowed, monotonic time
+        self.__lock = threading.Lock()
+        self.start_run()
+
+    def start_run(self) -> None:
+        '''Resets the statistics of the run, keeps the delay learned so far'''
+        with self.__lock:
+            self.__records = 0
+            self.__overloads = 0
+            self.__delays = []
+
+    def wait(self) -> None:
+        '''Blocks until the next submission is allowed - `delay` after the previous one'''
+        with self.__lock:
+            now = time.monotonic()
+            start = max(now, self.__last + self.delay)
+            self.__last = start
+        time.sleep(start - now)
+
+    def record(self, latency: Optional[float] = None, kind: Optional[str] = None) -> None:
+        '''Adjusts the delay after a record
+
+        :param latency: seconds from sending the commit until the next page was ready, None if not commited
+        :param kind: kind of failure of the record, None if it didn't fail
+        '''
+        with self.__lock:
+            self.__records += 1
+            usual = self.__latency if self.__latency is not None else self.step
+            if kind in OVERLOAD_KINDS:
+                self.__overloads += 1
+                self.delay = max(self.delay, usual) * self.backoff
+            elif latency is not None:
+                if self.__latency is not None and latency > self.slow_factor * self.__latency:
+                    self.delay += usual
+                    self.__latency = 0.95 * self.__latency + 0.05 * latency  # lasting slowness becomes usual
+                else:
+                    self.__latency = latency if self.__latency is None else 0.8 * self.__latency + 0.2 * latency
+                    self.delay *= self.recovery
+            self.delay = min(max(self.delay, self.min_delay), self.max_delay)
+            self.__delays.append(self.delay)
+
+    def summary(self) -> dict:
+        '''Delay and the submission rate it allows, the run's delay range and overload rate'''
+        with self.__lock:
+            return {
+                "delay": round(self.delay, 3),
+                "max_rate_per_min": round(60 / self.delay, 1) if self.delay else None,
+                "min_delay_used": round(min(self.__delays, default=self.delay), 3),
+                "max_delay_used": round(max(self.__delays, default=self.delay), 3),
+                "usual_latency": round(self.__latency, 3) if self.__latency is not None else None,
+                "records": self.__records,
+                "overload_rate": round(self.__overloads / self.__records, 3) if self.__records else 0.0,
+            }
+
+    def print_summary(self) -> None:
+        '''Prints the `summary` in one line'''
+        s = self.summary()
+        rate = f"at most {s['max_rate_per_min']:.1f} records/min" if s["max_rate_per_min"] else "unthrottled"
+        latency = f"{s['usual_latency']:.3f} s" if s["usual_latency"] is not None else "-"
+        print(f"Pacing: delay {s['delay']:.2f} s ({rate}), {s['min_delay_used']:.2f}-{s['max_delay_used']:.2f} s "
+              f"during the run, usual commit latency {latency}, overloaded {100 * s['overload_rate']:.1f}% of records")
@@ -0,0 +1,224 @@
+# Parallel importing with several ZiherPlus drivers
+# Author: Marek Szymański
+
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Optional
+try:
+    from typing import Self
+except ImportError:
+    from typing_extensions import Self
+
+from ziher_plus import ZiherPlus
+from zih_journal import ImportJournal
+from zih_loader import iter_data, load_workbook
+from zih_types import LogbookType
+from zih_validate import print_issues, validate_range
+
+
+class ZiherPlusPool:
+    '''Pool of independently logged-in ZiherPlus drivers importing one row range together
+
+    Records are put on a shared queue and each driver, in its own thread, takes the next
+    one as soon as it's done with the previous. Threads are enough - the drivers spend
+    their time waiting for the browsers and ZiHeR, not computing.
+    A failing driver doesn't stop the others: after `max_failures` failed records in a row
+    it retires and the rest of the queue is handled by the remaining ones.
+    Records failing for a passing reason go back on the queue, to be tried again
+    by any driver once their backoff delay passes (see `retries` of ZiherPlus).
+
+    :param factory: callable creating a driver, called with `human_control=False` and `kwargs`,
+                    e.g. `ZiherPlus.Chrome` or `ZiherPlusHTTP.Session`
+    :param workers: number of drivers
+    :param max_failures: consecutive failed records after which a driver retires
+    :param journal: path of the import journal shared by all drivers, see zih_journal.py
+    :param kwargs: passed to every `factory` call, `metrics` and `pacer` given here are shared
+                   by all drivers and summarized by the pool
+
+    :ivar drivers: the pool's drivers, created by `login`
+    :ivar report: outcome of each record of the last `send`, like `ZiherPlus.report`
+                  with the number of the driver which handled it in "worker", in row order
+    :ivar gave_up: records of the last `send` which failed for good, like in `report`
+    '''
+
+    def __init__(
+        self,
+        factory: Callable[..., ZiherPlus],
+        workers: int = 2,
+        max_failures: int = 3,
+        journal: Optional[str] = None,
+        **kwargs,
+    ):
+        self.__factory = factory
+        self.__workers = workers
+        self.__max_failures = max_failures
+        self.__kwargs = kwargs
+        self.__journal = ImportJournal(journal) if journal else None
+        self.__filename = None
+        self.__workbook = None
+        self.__worksheet = None
+        self.drivers = []
+        self.report = []
+        self.gave_up = []
+
+    def load(
+        self, filename: str, sheetname: Optional[str] = None, streaming: bool = False, cache: Optional[str] = None
+    ) -> Self:
+        """Loads the Excel file: `filename` and optionally opens worksheet `sheetname` or the active one
+
+        Data is loaded once and shared by all drivers, `streaming` and `cache` as in `load_workbook`.
+        """
+        if self.__workbook:
+            self.__workbook.close()
+        self.__filename = filename
+        self.__workbook, self.__worksheet = load_workbook(filename, sheetname, streaming, cache)
+        return self
+
+    def login(self, email: str, password: str, region: str = "pomorze") -> Self:
+        """Starts the drivers and logs each of them into ziher, in parallel"""
+        def start(nr: int):
+            try:
+                driver = self.__factory(human_control=False, **self.__kwargs)
+            except Exception as err:
+                print(f"Worker {nr} failed to start: {type(err).__name__}: {err}")
+                return
+            try:
+                driver.login(email, password, region)
+            except Exception as err:
+                print(f"Worker {nr} failed to log in: {type(err).__name__}: {err}")
+                driver.quit()
+                return
+            self.drivers[nr] = driver
+
+        self.drivers = [None] * self.__workers
+        self.__run_all(start, range(self.__workers))
+        self.drivers = [d for d in self.drivers if d is not None]
+        if not self.drivers:
+            raise RuntimeError("None of the pool's drivers managed to log in")
+        return self
+
+    def send(
+        self, logbook: LogbookType, min_row: int, max_row: Optional[int] = None, validate: bool = True
+    ) -> Self:
+        '''Import Excel data into ziher using all drivers
+
+        :param logbook: string identifying targeted logbook
+        :param min_row: nr of the first row of data to be imported
+        :param max_row: nr of the last row of data to be imported, leave out to import until the end of data
+        :param validate: check the rows first and send nothing if any has errors
+        '''
+        if validate:
+            issues = validate_range(self.__worksheet, min_row, max_row)
+            if issues:
+                print_issues(issues)
+            if any(x["level"] == "error" for x in issues):
+                print("Nothing sent - fix the errors or send with validate=False")
+                self.report = []
+                return self
+
+        records = iter_data(self.__worksheet, min_row, max_row)
+        if self.__journal:
+            records = list(self.__journal.pending(self.__filename, self.__worksheet.title, records))
+            if self.__journal.skipped:
+                print(f"Skipping {self.__journal.skipped} records already in the journal")
+
+        metrics = self.__kwargs.get("metrics")
+        if metrics:
+            metrics.start_run(logbook=logbook, engine=type(self).__name__, workers=len(self.drivers))
+        pacer = self.__kwargs.get("pacer")
+        if pacer:
+            pacer.start_run()
+
+        work = queue.Queue()
+        for i, record in enumerate(records):
+            work.put((i, record, 1, 0.0))  # nr, record, attempt, not before (monotonic time)
+
+        results = []
+        lock = threading.Lock()
+
+        def worker(nr: int):
+            driver = self.drivers[nr]
+            try:
+                driver.report = []
+                driver._open_log(logbook)
+            except Exception as err:
+                if not driver._recover(driver._classify(err), logbook):
+                    print(f"Worker {nr} failed to open the logbook: {type(err).__name__}: {err}")
+                    return
+
+            failures = 0
+            while failures < self.__max_failures:
+                try:
+                    i, record, attempt, due = work.get_nowait()
+                except queue.Empty:
+                    break
+                time.sleep(max(0.0, due - time.monotonic()))
+                result = driver._send_record(record, i, attempt)
+                failures = failures + 1 if result["status"] in ("failed", "retry") else 0
+                if result["status"] == "retry":
+                    work.put((i, record, attempt + 1, time.monotonic() + driver._retry_delay(attempt)))
+                    continue
+                if result["status"] == "sent" and self.__journal:
+                    self.__journal.add(self.__filename, self.__worksheet.title, record)
+                with lock:
+                    results.append((i, {**result, "worker": nr}))
+            else:
+                print(f"Worker {nr} retired after {failures} failed records in a row")
+
+        self.__run_all(worker, range(len(self.drivers)))
+
+        while not work.empty():  # left over when every driver retired
+            i, record, attempt, _ = work.get_nowait()
+            results.append((i, {"IDX": record.get("IDX"), "status": "failed", "error": "No working driver left",
+                                "kind": "other", "attempts": attempt - 1, "worker": None}))
+
+        self.report = [r for _, r in sorted(results, key=lambda r: r[0])]
+        self.gave_up = [r for r in self.report if r["status"] == "failed"]
+        self.print_report()
+        if pacer:
+            pacer.print_summary()
+        if metrics:
+            metrics.print_summary(metrics.end_run(logbook=logbook, **({"pacing": pacer.summary()} if pacer else {})))
+        return self
+
+    def print_report(self) -> None:
+        """Prints which record went through which driver and the totals"""
+        for r in self.report:
+            print(f"{r['IDX']}: {r['status']} (worker {r['worker']})" + (f" - {r['error']}" if r["error"] else ""))
+        counts = {}
+        for r in self.report:
+            counts[r["status"]] = counts.get(r["status"], 0) + 1
+        print(", ".join(f"{k}: {v}" for k, v in counts.items()))
+        if self.gave_up:
+            print("Gave up on records: " + ", ".join(f"{r['IDX']} ({r['kind']})" for r in self.gave_up))
+
+    def logout(self) -> Self:
+        """Logs all drivers out of ziher"""
+        self.__run_all(self.__safely("logout"), self.drivers)
+        return self
+
+    def quit(self) -> None:
+        """Closes all drivers and the loaded workbook"""
+        self.__run_all(self.__safely("quit"), self.drivers)
+        self.drivers = []
+        if self.__workbook:
+            self.__workbook.close()
+
+    @staticmethod
+    def __safely(method: str) -> Callable:
+        """Function calling `method` of a driver and reporting, instead of raising, its errors"""
+        def call(driver: ZiherPlus):
+            try:
+                getattr(driver, method)()
+            except Exception as err:
+                print(f"{method} failed: {type(err).__name__}: {err}")
+        return call
+
+    def __run_all(self, target: Callable, args: Iterable) -> None:
+        """Runs `target` for each of `args` in its own thread and waits for all of them"""
+        threads = [threading.Thread(target=target, args=(a,)) for a in args]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
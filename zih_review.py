@@ -0,0 +1,120 @@
+# Reviewing all records of a send at once, before any of them is submitted
+# Author: Marek Szymański
+
+import html
+import pathlib
+import webbrowser
+from typing import Optional
+
+from excel_specific import COLS
+from zih_types import ZihRecord
+
+# fields given their own columns, the rest (amounts) are listed together
+MAIN_FIELDS = [v["id"] for v in COLS.values() if v["type"] == "misc"] + ["type", "category"]
+HEADERS = {v["id"]: v["name"] for v in COLS.values() if v["type"] == "misc"}
+APPROVAL_PROMPT = "Approve: all / none / numbers and ranges to send (1-5 8) / all but numbers and ranges: "
+
+
+def _amounts(record: ZihRecord) -> str:
+    return ", ".join(f"{k}: {v}" for k, v in record.items() if k not in MAIN_FIELDS)
+
+
+def records_table(records: list[ZihRecord]) -> str:
+    '''Text table of `records`, one per line - all the fields `print_record` shows,
+    numbered from 1 for `parse_selection`'''
+    headers = ["#"] + [HEADERS.get(f, f) for f in MAIN_FIELDS] + ["kwoty"]
+    rows = [
+        [str(nr)] + [str(r.get(f, "")) for f in MAIN_FIELDS] + [_amounts(r)]
+        for nr, r in enumerate(records, 1)
+    ]
+    widths = [max(len(h), *(len(row[i]) for row in rows)) for i, h in enumerate(headers)]
+    lines = [" | ".join(c.ljust(w) for c, w in zip(headers, widths))]
+    lines.append("-+-".join("-" * w for w in widths))
+    lines += [" | ".join(c.ljust(w) for c, w in zip(row, widths)) for row in rows]
+    return "\n".join(lines)
+
+
+def write_report(records: list[ZihRecord], path: str, title: str = "ZiherPlus - przegląd") -> str:
+    '''Saves `records` as an HTML table, numbered like in `records_table`
+
+    :returns: file:// URI of the report
+    '''
+    head = "".join(f"<th>{html.escape(h)}</th>" for h in ["#", *(HEADERS.get(f, f) for f in MAIN_FIELDS), "kwoty"])
+    body = "".join(
+        "<tr>" + "".join(f"<td>{html.escape(str(c))}</td>"
+                         for c in [nr, *(r.get(f, "") for f in MAIN_FIELDS), _amounts(r)]) + "</tr>\n"
+        for nr, r in enumerate(records, 1)
+    )
+    page = f"""<!DOCTYPE html>
+<html lang="pl"><head><meta charset="utf-8"><title>{html.escape(title)}</title>
+<style>
+  body {{ font-family: sans-serif; }}
+  table {{ border-collapse: collapse; }}
+  th, td {{ border: 1px solid #999; padding: 2px 6px; }}
+  tr:nth-child(even) {{ background: #eee; }}
+</style></head>
+<body><h1>{html.escape(title)}</h1><p>{len(records)} records</p>
+<table><thead><tr>{head}</tr></thead><tbody>
+{body}</tbody></table></body></html>
+"""
+    file = pathlib.Path(path).resolve()
+    file.write_text(page, encoding="utf-8")
+    return file.as_uri()
+
+
+def parse_selection(text: str, count: int) -> list[int]:
+    '''Numbers (1 to `count`) of records chosen by `text`
+
+    `text` is "all", "none", numbers and ranges of records to approve ("1-5 8, 10")
+    or "all but" followed by numbers and ranges of records to reject.
+
+    :raises ValueError: when `text` can't be understood or a number is out of range
+
+    :returns: chosen numbers, ascending
+    '''
+    tokens = text.replace(",", " ").lower().split()
+    if tokens in ([], ["none"]):
+        return []
+    invert = tokens[0] == "all"
+    if invert:
+        tokens = tokens[2:] if tokens[1:2] == ["but"] else tokens[1:]
+
+    chosen = set()
+    for token in tokens:
+        first, _, last = token.partition("-")
+        if not first.isdigit() or (last and not last.isdigit()):
+            raise ValueError(f"not a number or range: {token}")
+        first, last = int(first), int(last or first)
+        if not 1 <= first <= last <= count:
+            raise ValueError(f"out of range 1-{count}: {token}")
+        chosen.update(range(first, last + 1))
+
+    if invert:
+        chosen = set(range(1, count + 1)) - chosen
+    return sorted(chosen)
+
+
+def review(records: list[ZihRecord], report: Optional[str] = None) -> list[ZihRecord]:
+    '''Shows all `records` at once and asks which of them to send
+
+    :param records: records as yielded by `iter_data`
+    :param report: also save them as an HTML report to this path and open it in the web browser
+
+    :returns: approved records, in their order
+    '''
+    if not records:
+        return []
+    print(records_table(records))
+    if report:
+        uri = write_report(records, report)
+        print(f"Report: {uri}")
+        webbrowser.open(uri)
+
+    while True:
+        try:
+            chosen = parse_selection(input(APPROVAL_PROMPT), len(records))
+            break
+        except ValueError as err:
+            print(err)
+    print(f"Approved {len(chosen)} of {len(records)} records")
+    return [records[nr - 1] for nr in chosen]
@@ -0,0 +1,48 @@
+# JavaScript snippets executed in the browser by ZiherPlus
+# Author: Marek Szymański
+
+'''Returns text of every cell of every row matched by the CSS selector passed as the first argument
+
+Used to read the whole logbook page in a single WebDriver call, instead of one per cell.
+'''
+SCRAPE_ROWS = """
+return Array.from(document.querySelectorAll(arguments[0])).map(
+    row => Array.from(row.querySelectorAll('td')).map(cell => cell.textContent.trim())
+);
+"""
+
+'''Fills inputs of the opened form in a single WebDriver call
+
+Takes a {input id: value} object as the first argument, sets each input's value
+and fires the "input" and "change" events the page would get from typing.
+Returns ids of the inputs which are not on the page (nothing is filled then).
+'''
+FILL_FORM = """
+const values = arguments[0];
+const missing = Object.keys(values).filter(id => !document.getElementById(id));
+if (missing.length) {
+    return missing;
+}
+for (const [id, value] of Object.entries(values)) {
+    const input = document.getElementById(id);
+    input.focus();
+    input.value = value;
+    input.dispatchEvent(new Event('input', {bubbles: true}));
+    input.dispatchEvent(new Event('change', {bubbles: true}));
+    input.blur();
+}
+return [];
+"""
+
+'''Returns seconds the current page took to load, by the browser's Navigation Timing
+
+Counts until the load event, or until the HTML was parsed if the page isn't fully loaded yet
+(e.g. with the "eager" page load strategy). Returns null if the browser doesn't report it.
+'''
+PAGE_LOAD_TIME = """
+const nav = performance.getEntriesByType('navigation')[0];
+if (!nav) {
+    return null;
+}
+return ((nav.loadEventEnd || nav.domInteractive) - nav.startTime) / 1000;
+"""
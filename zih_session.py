@@ -0,0 +1,57 @@
+# Cache of authenticated ZiHeR sessions, letting runs skip logging in
+# Author: Marek Szymański
+
+import hashlib
+import json
+import os
+import time
+from typing import Optional
+
+
+class SessionCache:
+    '''Cookies of logged-in ZiHeR sessions, kept on disk between runs, one file per region and account
+
+    Cookies are as good as the password for as long as the session lasts,
+    so the files are readable only by their owner.
+
+    :param directory: where to keep the cookie files, created if needed
+    :param max_age: seconds after which a saved session is no longer used
+    '''
+
+    def __init__(self, directory: str = ".ziher_sessions", max_age: float = 8 * 3600):
+        self.directory = directory
+        self.max_age = max_age
+
+    def load(self, region: str, email: str) -> Optional[list[dict]]:
+        '''Saved cookies of the `email` account in `region`, None if there are none or they're too old'''
+        try:
+            with open(self.__path(region, email), encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        now = time.time()
+        if now - saved.get("saved", 0) > self.max_age:
+            self.invalidate(region, email)
+            return None
+        cookies = [c for c in saved.get("cookies", []) if c.get("expiry", now + 1) > now]
+        return cookies or None
+
+    def save(self, region: str, email: str, cookies: list[dict]) -> None:
+        '''Saves `cookies` of the `email` account in `region`'''
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.__path(region, email)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "w", encoding="utf-8") as f:
+            json.dump({"saved": time.time(), "cookies": cookies}, f)
+
+    def invalidate(self, region: str, email: str) -> None:
+        '''Forgets the session of the `email` account in `region`'''
+        try:
+            os.remove(self.__path(region, email))
+        except FileNotFoundError:
+            pass
+
+    def __path(self, region: str, email: str) -> str:
+        key = hashlib.sha1(f"{region}/{email.lower()}".encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f"{key}.json")
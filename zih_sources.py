@@ -0,0 +1,274 @@
+# Non-Excel data sources and the cache of parsed worksheets for ZiherPlus
+# Author: Marek Szymański
+
+import csv
+import datetime
+import hashlib
+import os
+import pickle
+import re
+import zipfile
+from typing import Callable, Iterator, Optional
+from xml.etree import ElementTree
+
+from excel_specific import AGGREGATES, COLS
+
+CACHE_VERSION = 2
+
+
+def iter_values(
+    ws, min_row: int = 1, max_row: Optional[int] = None, max_col: Optional[int] = None
+) -> Iterator[tuple]:
+    '''Yields cell values of rows `min_row` to `max_row` of `ws` - an openpyxl Worksheet or a RowsSheet
+
+    :param ws: worksheet to read
+    :param min_row: first row to read
+    :param max_row: last row to read, leave out to read until the end of the sheet
+    :param max_col: number of columns to read, leave out for all
+    '''
+    if isinstance(ws, RowsSheet):
+        return ws.iter_values(min_row, max_row, max_col)
+    return ws.iter_rows(min_row=min_row, max_row=max_row, max_col=max_col, values_only=True)
+
+
+class RowsSheet:
+    '''Values of a worksheet's rows - read from a source other than Excel or from the cache, see `iter_values`
+
+    :param title: name of the sheet
+    :param rows: cell values of each row, starting with row 1 and column 1
+    '''
+
+    def __init__(self, title: str, rows: list[tuple]):
+        self.title = title
+        self.rows = rows
+
+    @property
+    def max_row(self) -> int:
+        return len(self.rows)
+
+    def iter_values(
+        self, min_row: int = 1, max_row: Optional[int] = None, max_col: Optional[int] = None
+    ) -> Iterator[tuple]:
+        '''Yields values of rows `min_row` to `max_row`, padded or cut to `max_col` columns'''
+        for row in self.rows[min_row - 1:max_row]:
+            if max_col is not None:
+                row = tuple(row[:max_col]) + (None,) * (max_col - len(row))
+            yield row
+        if max_row is not None:
+            for _ in range(max(len(self.rows), min_row - 1), max_row):
+                yield (None,) * (max_col or 0)
+
+
+class RowsWorkbook:
+    '''Workbook-like collection of RowsSheets, sheets not yet read are loaded with `loader`
+
+    :param sheets: already read sheets, by title
+    :param active: title of the sheet returned by `active`, None for the first one
+    :param loader: function reading a sheet by its title (None - the active one)
+    '''
+    read_only = False
+
+    def __init__(
+        self,
+        sheets: dict[str, RowsSheet],
+        active: Optional[str] = None,
+        loader: Optional[Callable[[Optional[str]], RowsSheet]] = None,
+    ):
+        self.__sheets = dict(sheets)
+        self.__active = active
+        self.__loader = loader
+
+    @property
+    def sheetnames(self) -> list[str]:
+        return list(self.__sheets)
+
+    @property
+    def active(self) -> RowsSheet:
+        if self.__active is None and self.__loader:
+            sheet = self.__loader(None)
+            self.__active = sheet.title
+            self.__sheets[sheet.title] = sheet
+        return self[self.__active or next(iter(self.__sheets))]
+
+    def __getitem__(self, title: str) -> RowsSheet:
+        if title not in self.__sheets:
+            if not self.__loader:
+                raise KeyError(f"Worksheet {title} does not exist.")
+            self.__sheets[title] = self.__loader(title)
+        return self.__sheets[title]
+
+    def close(self) -> None:
+        pass
+
+
+# ==========================================================
+# CSV
+# ==========================================================
+
+NUMBER = re.compile(r"^-?\d+([.,]\d+)?$")
+DATE_FORMATS = ["%Y-%m-%d", "%d.%m.%Y"]
+# columns read as numbers (record number, amounts, aggregates) and as dates, the rest stays text
+NUMBER_COLS = {k for k, v in COLS.items() if v["type"] != "misc" or v["id"] == "IDX"} | set(AGGREGATES)
+DATE_COLS = {k for k, v in COLS.items() if v["name"] == "data"}
+
+
+def csv_value(text: str, column: int):
+    '''Converts a CSV field of `column` (numbered from 1) to what Excel would have in the cell:
+    None, number (in NUMBER_COLS), date (in DATE_COLS) or text - document numbers like "0012" stay text'''
+    text = text.strip()
+    if not text:
+        return None
+    compact = text.replace(" ", "").replace("\xa0", "")
+    if column in NUMBER_COLS and NUMBER.match(compact):
+        number = float(compact.replace(",", "."))
+        return int(number) if number.is_integer() and "," not in compact and "." not in compact else number
+    if column in DATE_COLS:
+        for fmt in DATE_FORMATS:
+            try:
+                return datetime.datetime.strptime(text, fmt)
+            except ValueError:
+                pass
+    return text
+
+
+def load_csv(filename: str) -> RowsWorkbook:
+    '''Reads a CSV export of the spreadsheet, with "," or ";" separated fields
+
+    :returns: workbook with a single sheet, named after the file
+    '''
+    with open(filename, newline="", encoding="utf-8-sig") as f:
+        sample = f.read(64 * 1024)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        rows = [tuple(csv_value(v, col) for col, v in enumerate(row, 1)) for row in csv.reader(f, dialect)]
+
+    title = os.path.splitext(os.path.basename(filename))[0]
+    return RowsWorkbook({title: RowsSheet(title, rows)})
+
+
+# ==========================================================
+# ODS
+# ==========================================================
+
+ODS_NS = {
+    "table": "urn:oasis:names:tc:opendocument:xmlns:table:1.0",
+    "office": "urn:oasis:names:tc:opendocument:xmlns:office:1.0",
+    "text": "urn:oasis:names:tc:opendocument:xmlns:text:1.0",
+}
+
+
+def _ods(ns: str, name: str) -> str:
+    return f"{{{ODS_NS[ns]}}}{name}"
+
+
+def _ods_cell_value(cell: ElementTree.Element):
+    kind = cell.get(_ods("office", "value-type"))
+    if kind in ("float", "currency", "percentage"):
+        number = float(cell.get(_ods("office", "value")))
+        return int(number) if number.is_integer() else number
+    if kind == "date":
+        return datetime.datetime.fromisoformat(cell.get(_ods("office", "date-value")))
+    if kind is None:
+        return None
+    text = "\n".join("".join(p.itertext()) for p in cell.iter(_ods("text", "p")))
+    return text or None
+
+
+def _ods_rows(table: ElementTree.Element) -> list[tuple]:
+    '''Values of the rows of an ODS table, with repeated rows/cells expanded,
+    but without the huge empty blocks spreadsheets pad the sheet with'''
+    rows, empty_rows = [], 0
+    for row in table.iter(_ods("table", "table-row")):
+        values, empty_cells = [], 0
+        for cell in row:
+            if cell.tag not in (_ods("table", "table-cell"), _ods("table", "covered-table-cell")):
+                continue
+            value = _ods_cell_value(cell)
+            repeat = int(cell.get(_ods("table", "number-columns-repeated"), 1))
+            if value is None:
+                empty_cells += repeat
+                continue
+            values += [None] * empty_cells + [value] * repeat
+            empty_cells = 0
+
+        repeat = int(row.get(_ods("table", "number-rows-repeated"), 1))
+        if not values:
+            empty_rows += repeat
+            continue
+        rows += [()] * empty_rows + [tuple(values)] * repeat
+        empty_rows = 0
+    return rows
+
+
+def load_ods(filename: str) -> RowsWorkbook:
+    '''Reads all sheets of an OpenDocument spreadsheet (LibreOffice .ods)'''
+    with zipfile.ZipFile(filename) as z, z.open("content.xml") as f:
+        root = ElementTree.parse(f).getroot()
+
+    sheets = {}
+    for table in root.iter(_ods("table", "table")):
+        title = table.get(_ods("table", "name"))
+        sheets[title] = RowsSheet(title, _ods_rows(table))
+    return RowsWorkbook(sheets)
+
+
+# ==========================================================
+# Cache
+# ==========================================================
+
+class CachedWorkbook(RowsWorkbook):
+    '''Workbook whose sheets are read from the source file once and then from the cache
+
+    A sheet's rows are saved to `cache_dir` after the first read, keyed by the absolute
+    path of the file and the sheet name, along with the file's modification time and size.
+    While these don't change, later loads skip parsing the source entirely.
+
+    :param filename: source file
+    :param cache_dir: directory for cached sheets, created if needed
+    :param open_source: function opening the source file as a workbook, called only on a cache miss
+    '''
+
+    def __init__(self, filename: str, cache_dir: str, open_source: Callable[[], object]):
+        self.__filename = os.path.abspath(filename)
+        self.__cache_dir = cache_dir
+        self.__open_source = open_source
+        super().__init__({}, loader=self.__load)
+
+    def __load(self, title: Optional[str]) -> RowsSheet:
+        stat = os.stat(self.__filename)
+        stamp = (CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+        key = hashlib.sha1(f"{self.__filename}\0{title or ''}".encode()).hexdigest()[:16]
+        path = os.path.join(self.__cache_dir, f"{key}.pickle")
+
+        try:
+            with open(path, "rb") as f:
+                cached = pickle.load(f)
+            if cached["stamp"] == stamp:
+                return RowsSheet(cached["title"], cached["rows"])
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+            pass
+
+        wb = self.__open_source()
+        try:
+            ws = wb[title] if title else wb.active
+            rows = [_trim(row) for row in iter_values(ws)]
+            sheet = RowsSheet(ws.title, rows)
+        finally:
+            wb.close()
+
+        os.makedirs(self.__cache_dir, exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump({"stamp": stamp, "title": sheet.title, "rows": rows}, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        return sheet
+
+
+def _trim(row: tuple) -> tuple:
+    '''`row` without trailing empty cells'''
+    end = len(row)
+    while end and row[end - 1] is None:
+        end -= 1
+    return tuple(row[:end])
@@ -0,0 +1,151 @@
+# Pre-flight validation of spreadsheet rows, before anything is sent to ZiHeR
+# Author: Marek Szymański
+
+import datetime
+import re
+from typing import Optional
+
+from openpyxl.worksheet.worksheet import Worksheet
+
+from excel_specific import AGGREGATES, COLS
+from zih_loader import IDX_COL
+from zih_sources import iter_values
+
+DATE_COL = next(k for k, v in COLS.items() if v["name"] == "data")
+INCOME_COLS = [k for k, v in COLS.items() if v["type"] == "income"]
+COST_COLS = [k for k, v in COLS.items() if v["type"] == "cost"]
+SHARE_COLS = [k for k, v in COLS.items() if v["type"] in ("onep", "grant")]
+COST_COL_OF_ITEM = {COLS[k]["id"]: k for k in COST_COLS}
+LAST_COL = max([*COLS, *AGGREGATES])
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+TOLERANCE = 0.005
+
+
+def _number(value) -> Optional[float]:
+    '''`value` as float, None if it's not a number (booleans included)'''
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).strip())
+    except ValueError:
+        return None
+
+
+def _valid_date(value) -> bool:
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return True
+    if not isinstance(value, str) or not ISO_DATE.match(value.strip()):
+        return False
+    try:
+        datetime.date.fromisoformat(value.strip())
+    except ValueError:
+        return False
+    return True
+
+
+def validate_range(ws: Worksheet, min_row: int, max_row: Optional[int] = None) -> list[dict]:
+    '''Checks all rows from `min_row` to `max_row` at once, column by column
+
+    Errors (the row would fail or be imported wrong):
+    - date neither an Excel date nor a YYYY-MM-DD text,
+    - amount which isn't a number,
+    - no amount at all,
+    - both income and cost amounts in one row,
+    - 1% or grant amount which isn't a number, can't be assigned to a cost item
+      or, together with the other shares, exceeds the item's amount.
+    Warnings: amounts not adding up to the AGGREGATES columns.
+
+    :param ws: Excel worksheet to check
+    :param min_row: first row of record data
+    :param max_row: last row of record data, leave out to stop at the end of data, like `iter_data`
+
+    :returns: list of {"row", "IDX", "column", "level", "problem"} dicts, level is "error" or "warning"
+    '''
+    rows = []
+    for row in iter_values(ws, min_row, max_row, LAST_COL):
+        if max_row is None and (len(row) < IDX_COL or not row[IDX_COL - 1]):
+            break
+        rows.append(tuple(row) + (None,) * (LAST_COL - len(row)))
+    if not rows:
+        return []
+
+    columns = dict(zip(range(1, LAST_COL + 1), zip(*rows)))
+    numbers = {c: [_number(v) if v not in (None, "") else 0.0 for v in columns[c]]
+               for c in [*INCOME_COLS, *COST_COLS, *SHARE_COLS, *AGGREGATES]}
+    issues = []
+
+    def issue(i: int, col: int, level: str, problem: str):
+        issues.append({"row": min_row + i, "IDX": columns[IDX_COL][i], "column": col,
+                       "level": level, "problem": problem})
+
+    for i, date in enumerate(columns[DATE_COL]):
+        if not _valid_date(date):
+            issue(i, DATE_COL, "error", f"invalid date: {date!r}")
+
+    for col in [*INCOME_COLS, *COST_COLS, *SHARE_COLS]:
+        for i, (raw, value) in enumerate(zip(columns[col], numbers[col])):
+            if value is None:
+                issue(i, col, "error", f"amount is not a number: {raw!r}")
+
+    def total(cols: list[int], i: int) -> float:
+        return sum(numbers[c][i] or 0.0 for c in cols)
+
+    incomes = [total(INCOME_COLS, i) for i in range(len(rows))]
+    costs = [total(COST_COLS, i) for i in range(len(rows))]
+    has_income = [any(columns[c][i] not in (None, "", 0) for c in INCOME_COLS) for i in range(len(rows))]
+    has_cost = [any(columns[c][i] not in (None, "", 0) for c in COST_COLS) for i in range(len(rows))]
+    for i in range(len(rows)):
+        if has_income[i] and has_cost[i]:
+            issue(i, None, "error", "both income and cost amounts in one row")
+        elif not has_income[i] and not has_cost[i]:
+            issue(i, None, "error", "no amount")
+
+    for i in range(len(rows)):
+        shares = {}  # cost column -> sum of its 1% and grant amounts
+        for col in SHARE_COLS:
+            if columns[col][i] in (None, "", 0) or numbers[col][i] is None:
+                continue
+            if COLS[col]["id"] is not None:
+                target = COST_COL_OF_ITEM.get(COLS[col]["id"])
+            else:
+                filled = [c for c in COST_COLS if columns[c][i] not in (None, "", 0)]
+                target = filled[0] if len(filled) == 1 else None
+            if target is None or columns[target][i] in (None, "", 0):
+                issue(i, col, "error", f"{COLS[col]['name']} needs exactly one cost amount to belong to")
+                continue
+            shares[target] = shares.get(target, 0.0) + numbers[col][i]
+        for target, share in shares.items():
+            if numbers[target][i] is not None and share - numbers[target][i] > TOLERANCE:
+                issue(i, target, "error", f"1% and grant amounts ({share:.2f}) exceed the cost amount")
+
+    for col, agg in AGGREGATES.items():
+        for i, value in enumerate(numbers[col]):
+            if columns[col][i] in (None, ""):
+                continue
+            if value is None:
+                issue(i, col, "warning", f"{agg['name']} is not a number: {columns[col][i]!r}")
+                continue
+            if agg["of"] == "income":
+                expected = incomes[i]
+            elif agg["of"] == "cost":
+                expected = costs[i]
+            elif agg["of"] == "balance" and i > 0 and numbers[col][i - 1] is not None:
+                expected = numbers[col][i - 1] + incomes[i] - costs[i]
+            else:
+                continue
+            if abs(value - expected) > TOLERANCE:
+                issue(i, col, "warning", f"{agg['name']} is {value:.2f}, amounts give {expected:.2f}")
+
+    issues.sort(key=lambda x: x["row"])
+    return issues
+
+
+def print_issues(issues: list[dict]) -> None:
+    '''Prints the report of `validate_range`'''
+    for x in issues:
+        column = f", column {x['column']}" if x["column"] else ""
+        print(f"{x['level'].upper()}: row {x['row']} (record {x['IDX']}{column}): {x['problem']}")
+    errors = sum(x["level"] == "error" for x in issues)
+    print(f"{errors} errors, {len(issues) - errors} warnings")
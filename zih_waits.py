@@ -0,0 +1,54 @@
+# Explicit waits used by ZiherPlus instead of fixed sleeps
+# Author: Marek Szymański
+
+from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.webdriver import WebDriver
+from selenium.webdriver.remote.webelement import WebElement
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+'''Default timeouts (in seconds) of each kind of wait
+
+"page":    page load after a navigation, e.g. after commiting a form
+"form":    entry form becoming visible after clicking the new entry button
+"element": links and buttons becoming clickable
+'''
+DEFAULT_TIMEOUTS = {
+    "page": 15,
+    "form": 10,
+    "element": 10,
+}
+
+
+def page_loaded(driver: WebDriver) -> bool:
+    '''Expected condition: the document has been parsed'''
+    return driver.execute_script("return document.readyState") != "loading"
+
+
+def wait_loaded(driver: WebDriver, timeout: float) -> None:
+    '''Waits until the current page is loaded'''
+    WebDriverWait(driver, timeout).until(page_loaded)
+
+
+def wait_visible(driver: WebDriver, locator: tuple[str, str], timeout: float) -> WebElement:
+    '''Waits until element at `locator` is visible and returns it'''
+    return WebDriverWait(driver, timeout).until(EC.visibility_of_element_located(locator))
+
+
+def wait_clickable(driver: WebDriver, locator: tuple[str, str], timeout: float) -> WebElement:
+    '''Waits until element at `locator` can be clicked and returns it'''
+    return WebDriverWait(driver, timeout).until(EC.element_to_be_clickable(locator))
+
+
+def click_and_wait(driver: WebDriver, element: WebElement, timeout: float) -> None:
+    '''Clicks `element` and waits until the page it navigates to is loaded
+
+    :param driver: driver owning the `element`
+    :param element: link or button causing a navigation
+    :param timeout: how long to wait for the new page
+    '''
+    old_page = driver.find_element(By.TAG_NAME, "html")
+    element.click()
+    wait = WebDriverWait(driver, timeout)
+    wait.until(EC.staleness_of(old_page))
+    wait.until(page_loaded)
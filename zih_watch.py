@@ -0,0 +1,74 @@
+# Watching a workbook for records appended or edited since the last import
+# Author: Marek Szymański
+
+import os
+import time
+from typing import Iterable, Optional
+
+from zih_loader import record_hash
+from zih_types import ZihRecord
+
+
+def file_stamp(path: str) -> Optional[tuple[int, int]]:
+    '''Modification time and size of the file at `path`, None if it can't be read'''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class FileWatcher:
+    '''Tells when a file has been changed
+
+    Spreadsheet apps save files in steps, so a change only counts once the file
+    stays the same for `settle` seconds.
+
+    :param path: file to watch
+    :param settle: seconds the changed file must stay unchanged
+    '''
+
+    def __init__(self, path: str, settle: float = 2.0):
+        self.path = path
+        self.settle = settle
+        self.__seen = None
+
+    def changed(self) -> bool:
+        '''Has the file changed since the last call which returned True (or ever, on the first call)'''
+        stamp = file_stamp(self.path)
+        if stamp is None or stamp == self.__seen:
+            return False
+        time.sleep(self.settle)
+        if file_stamp(self.path) != stamp:
+            return False  # still being written, checked again later
+        self.__seen = stamp
+        return True
+
+
+class RowTracker:
+    '''Remembers which version of each record has been imported - by its "IDX" and `record_hash`
+
+    :ivar imported: {IDX: hash} of the records imported (or deliberately left out) so far
+    '''
+
+    def __init__(self):
+        self.imported = {}
+
+    def changes(self, records: Iterable[ZihRecord]) -> tuple[list[ZihRecord], list[ZihRecord]]:
+        '''Records which aren't imported yet, in their order
+
+        :returns: new records and records imported before, but edited since
+        '''
+        new, edited = [], []
+        for record in records:
+            idx = str(record.get("IDX"))
+            if idx not in self.imported:
+                new.append(record)
+            elif self.imported[idx] != record_hash(record):
+                edited.append(record)
+        return new, edited
+
+    def mark(self, records: Iterable[ZihRecord]) -> None:
+        '''Remembers the current version of `records` as imported'''
+        for record in records:
+            self.imported[str(record.get("IDX"))] = record_hash(record)
@@ -0,0 +1,440 @@
+# Browserless HTTP engine for ZiherPlus
+# Author: Marek Szymański
+
+from html.parser import HTMLParser
+from typing import Callable, Optional
+from urllib.parse import urljoin
+import requests
+
+from ziher_plus import ZiherPlus
+from site_specific import HTMLLocators, FormFieldIDs, SiteURL
+from zih_errors import EntryRejectedError, LoginError, MissingFieldsError, ZiherError
+from zih_types import ZihRecord, LogbookType, EntryType
+
+
+class Page(HTMLParser):
+    '''Minimal HTML scraper collecting what ZiherPlus needs from a ZiHeR page
+
+    :param url: address the page was fetched from, used to resolve relative links
+    :param html: page source
+
+    :ivar url: address of the page
+    :ivar csrf_token: Rails CSRF token from the page's <meta> tag, if present
+    :ivar links: list of {"href", "class", "text", "rel"} dicts, one per <a> element
+    :ivar forms: list of {"action", "method", "fields"} dicts, one per <form> element,
+                 "fields" is a list of {"name", "id", "value", "type"} dicts in document order
+    :ivar rows: texts of the <td> cells of every table row having any
+    :ivar errors: texts of the <li> elements of the form's error explanation, if there's one
+    '''
+    def __init__(self, url: str, html: str):
+        super().__init__(convert_charrefs=True)
+        self.url = url
+        self.csrf_token = None
+        self.links = []
+        self.forms = []
+        self.rows = []
+        self.errors = []
+        self.__errors = None  # [tag, nesting] of the open error explanation element
+        self.__error = None
+        self.__link = None
+        self.__row = None
+        self.__cell = None
+        self.__form = None
+        self.__textarea = None
+        self.__select = None
+        self.feed(html)
+        self.close()
+
+    def link(
+        self, text: Optional[str] = None, cls: Optional[str] = None, nr: int = 0, rel: Optional[str] = None
+    ) -> Optional[str]:
+        '''Absolute href of the `nr`-th link with text containing `text` and/or class equal to `cls`
+        and/or `rel` among its rel values'''
+        found = [
+            l for l in self.links
+            if (text is None or text in l["text"]) and (cls is None or l["class"] == cls)
+            and (rel is None or rel in l["rel"].split())
+        ]
+        return urljoin(self.url, found[nr]["href"]) if len(found) > nr else None
+
+    def form(self, field_id: str) -> Optional[dict]:
+        '''First form containing input with id `field_id`'''
+        for form in self.forms:
+            if any(f["id"] == field_id for f in form["fields"]):
+                return form
+        return None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {k: v if v is not None else "" for k, v in attrs}
+        if attrs.get("id") == HTMLLocators["ErrorsID"]:
+            self.__errors = [tag, 0]
+        if self.__errors is not None:
+            self.__errors[1] += tag == self.__errors[0]
+            if tag == "li":
+                self.__error = ""
+
+        if tag == "meta" and attrs.get("name") == HTMLLocators["CSRFMetaName"]:
+            self.csrf_token = attrs.get("content")
+        elif tag == "a":
+            self.__link = {
+                "href": attrs.get("href", ""),
+                "class": attrs.get("class", ""),
+                "rel": attrs.get("rel", ""),
+                "text": "",
+            }
+            self.links.append(self.__link)
+        elif tag == "tr":
+            self.__row = []
+            self.rows.append(self.__row)
+        elif tag == "td" and self.__row is not None:
+            self.__cell = ""
+        elif tag == "form":
+            self.__form = {
+                "action": urljoin(self.url, attrs.get("action", "")),
+                "method": attrs.get("method", "get").lower(),
+                "fields": [],
+            }
+            self.forms.append(self.__form)
+        elif self.__form is None:
+            return
+        elif tag == "option" and self.__select is not None:
+            if self.__select["value"] is None or "selected" in attrs:
+                self.__select["value"] = attrs.get("value", "")
+        elif "name" not in attrs:
+            return
+        elif tag == "input":
+            kind = attrs.get("type", "text").lower()
+            if kind in ("checkbox", "radio") and "checked" not in attrs:
+                return
+            self.__add_field(attrs, attrs.get("value", ""), kind)
+        elif tag == "textarea":
+            self.__textarea = self.__add_field(attrs, "", "textarea")
+        elif tag == "select":
+            self.__select = self.__add_field(attrs, None, "select")
+
+    def handle_endtag(self, tag):
+        if self.__errors is not None:
+            if tag == "li" and self.__error is not None:
+                self.errors.append(self.__error.strip())
+                self.__error = None
+            self.__errors[1] -= tag == self.__errors[0]
+            if not self.__errors[1]:
+                self.__errors = None
+
+        if tag == "a":
+            self.__link = None
+        elif tag == "td" and self.__cell is not None:
+            self.__row.append(self.__cell.strip())
+            self.__cell = None
+        elif tag == "tr":
+            if self.__row is not None and not self.__row:
+                self.rows.remove(self.__row)
+            self.__row = None
+        elif tag == "form":
+            self.__form = None
+        elif tag == "textarea":
+            self.__textarea = None
+        elif tag == "select":
+            if self.__select is not None and self.__select["value"] is None:
+                self.__select["value"] = ""
+            self.__select = None
+
+    def handle_data(self, data):
+        if self.__link is not None:
+            self.__link["text"] = (self.__link["text"] + data.strip()).strip()
+        if self.__textarea is not None:
+            self.__textarea["value"] += data
+        if self.__cell is not None:
+            self.__cell += data
+        if self.__error is not None:
+            self.__error += data
+
+    def __add_field(self, attrs: dict, value: Optional[str], kind: str) -> dict:
+        field = {"name": attrs["name"], "id": attrs.get("id", ""), "value": value, "type": kind}
+        self.__form["fields"].append(field)
+        return field
+
+
+class ZiherPlusHTTP(ZiherPlus):
+    '''Automation driver for ZiHeR talking to it directly over HTTP, without a browser
+
+    Drop-in replacement for ZiherPlus - the API (`login`, `load`, `send`, `logout`, `quit`)
+    is the same, but instead of clicking through the pages it fetches them, reads the Rails
+    CSRF tokens and link targets from the HTML and POSTs the forms itself,
+    over a single keep-alive connection.
+
+    :param session: requests.Session to be used, leave out to create a new one
+    :param human_control: will the procces be controlled by human or fully automated
+    :param filename: use to immediately load workbook
+    :param sheetname: use to immediately load worksheet
+    :param base_url: address of the ZiHeR instance, change to use a local stand-in server
+    :param timeout: timeout of a single HTTP request, in seconds
+    :param kwargs: other ZiherPlus options, e.g. `streaming`
+
+    :ivar _session: requests.Session holding the connection and the login cookies
+    :ivar _page: last fetched page
+    :ivar _form: form opened by `_open_form`, as returned by `Page.form`
+    '''
+
+    def __init__(
+        self,
+        session: Optional[requests.Session] = None,
+        human_control: bool = True,
+        filename: Optional[str] = None,
+        sheetname: Optional[str] = None,
+        base_url: str = SiteURL,
+        timeout: float = 30,
+        **kwargs,
+    ):
+        self._session = session if session is not None else requests.Session()
+        self._timeout = timeout
+        self._page = None
+        self._form = None
+        super().__init__(
+            driver=None,
+            human_control=human_control,
+            filename=filename,
+            sheetname=sheetname,
+            base_url=base_url,
+            **kwargs,
+        )
+
+    def quit(self) -> None:
+        '''Closes ZiherPlusHTTP and its connections'''
+        self._session.close()
+        self._close_workbooks()
+
+    # Convenience constructors for parity with the browser engines
+
+    @classmethod
+    def Session(cls, human_control: bool = True, **kwargs):
+        '''ZiherPlusHTTP driver with a new keep-alive session'''
+        return cls(requests.Session(), human_control, **kwargs)
+
+    # ==========================================================
+    # Private methods
+    # ==========================================================
+
+    # Page primitives
+
+    def _setup_driver(self) -> None:
+        self._session.headers.update({"Connection": "keep-alive"})
+
+    def _sign_in(self, email: str, password: str, region: str) -> None:
+        """Fetches and sends the sign-in form, leaves the engine on the welcome page"""
+        page = self._get(f"{self._base_url}/{region}/{HTMLLocators['SignInPath']}")
+        form = page.form(HTMLLocators["MailInputID"])
+        if form is None:
+            raise LoginError(f"No sign-in form at {page.url}")
+
+        values = {
+            HTMLLocators["MailInputID"]: email,
+            HTMLLocators["PasswordInputID"]: password,
+        }
+        self._page = self._submit(form, values, page)
+        if HTMLLocators["SignInPath"] in self._page.url:
+            raise LoginError(f"ZiHeR rejected the credentials of {email}")
+
+    def _sign_out(self) -> None:
+        """Sends the logout request, leaves the engine on the ziher login page"""
+        page = self._page
+        href = page.link(text=HTMLLocators["LogoutLinkText"]) if page else None
+        if href is None:
+            href = f"{self._base_url}/{self._region}/users/sign_out"
+        token = page.csrf_token if page and page.csrf_token else ""
+        self._page = self._request(
+            "post", href, data={"_method": "delete", "authenticity_token": token}
+        )
+
+    def _signed_out(self) -> bool:
+        """Is the engine on the sign-in page"""
+        return self._page is not None and HTMLLocators["SignInPath"] in self._page.url
+
+    def _go_home(self) -> None:
+        """Fetches the welcome page of the region"""
+        self._form = None
+        self._page = self._get(f"{self._base_url}/{self._region}/")
+
+    def _classify(self, err: Exception) -> str:
+        """Kind of failure `err` means, one of FAILURE_KINDS - network errors included"""
+        kind = super()._classify(err)
+        if kind != "other":
+            return kind
+        if isinstance(err, requests.Timeout):
+            return "timeout"
+        if isinstance(err, requests.ConnectionError):
+            return "network"
+        if isinstance(err, requests.HTTPError) and err.response is not None and err.response.status_code >= 500:
+            return "network"
+        return kind
+
+    def _get_cookies(self) -> list[dict]:
+        """Cookies of the current session, in the format of selenium's `get_cookies`"""
+        return [
+            {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path,
+             **({"expiry": c.expires} if c.expires else {})}
+            for c in self._session.cookies
+        ]
+
+    def _restore_session(self, cookies: list[dict]) -> bool:
+        """Loads saved `cookies` into the session and fetches the welcome page with them
+
+        :returns: is the session still valid
+        """
+        for c in cookies:
+            self._session.cookies.set(c["name"], c["value"], domain=c.get("domain", ""), path=c.get("path", "/"))
+        self._page = self._get(f"{self._base_url}/{self._region}/")
+        return HTMLLocators["SignInPath"] not in self._page.url
+
+    def _send_prefetching(self, records) -> None:
+        """Forms come without page loads and rendering here, so there's nothing to prefetch"""
+        self._send_retrying(records)
+
+    def _open_log(self, book: LogbookType):
+        """Switch to another logbook
+
+        Fetches the logbook's address directly, if it's known already,
+        otherwise follows its link and learns the addresses of the logbook and its forms.
+
+        :param book: string identifying logbook
+        """
+        self._logbook = book
+        url = self._cached_url("log")
+        page = self._fetch(url, lambda p: p.link(cls=HTMLLocators["FormButtonClass"])) if url else None
+        if page:
+            self._page = page
+            return
+
+        self._forget_urls()
+        texts = {
+            "bankowa": HTMLLocators["BankLogLinkText"],
+            "finansowa": HTMLLocators["FinLogLinkText"],
+        }
+        href = self._page.link(text=texts.get(book, book)) if self._page else None
+        if href is None:
+            raise ZiherError(f"No link to logbook '{book}' on {self._page and self._page.url}")
+        self._page = self._get(href)
+        if self._signed_out():
+            raise ZiherError("Signed out by ZiHeR")
+
+        self._cache_url("log", self._page.url)
+        for nr, formtype in enumerate(["income", "cost"]):
+            href = self._page.link(cls=HTMLLocators["FormButtonClass"], nr=nr)
+            if href:
+                self._cache_url(formtype, href)
+
+    def _scrape_log(self) -> list[list[str]]:
+        """Texts of the cells of every entry row, from all pages of the opened logbook"""
+        page, rows = self._page, []
+        while True:
+            rows += page.rows
+            href = page.link(rel=HTMLLocators["NextPageRel"])
+            if href is None:
+                break
+            page = self._get(href)
+        return rows
+
+    def _open_form(self, formtype: EntryType):
+        """Fetches correct form - either for declaring income or cost
+
+        Fetches the form's address directly, if it's known already, otherwise follows
+        its button on the logbook page - reopening the logbook if the known address failed.
+
+        :param formtype: which form to open
+        """
+        url = self._cached_url(formtype)
+        form_page = self._fetch(url, lambda p: p.form(FormFieldIDs["date"])) if url else None
+        if url and form_page is None:
+            self._forget_urls()
+            self._open_log(self._logbook)
+
+        if form_page is None:
+            nr = 0 if formtype == "income" else 1
+            href = self._page.link(cls=HTMLLocators["FormButtonClass"], nr=nr)
+            if href is None:
+                raise ZiherError(f"No button for new {formtype} entry on {self._page.url}")
+            form_page = self._get(href)
+
+        self._form = form_page.form(FormFieldIDs["date"])
+        if self._form is None:
+            raise ZiherError(f"No entry form at {form_page.url}")
+        self._form["page"] = form_page
+
+    def _fill_fields(self, entry_data: ZihRecord) -> None:
+        """Puts values from `entry_data` into the fetched form
+
+        :param entry_data: dict conatining input_ids, respective input values
+                           and other info that's not sent to the form
+        """
+        values = {k: v for k, v in entry_data.items() if k not in ["type", "category", "IDX"]}
+        ids = {f["id"] for f in self._form["fields"]}
+        missing = [k for k in values if k not in ids]
+        if missing:
+            self._form = None
+            raise MissingFieldsError(missing)
+        self._form["values"] = values
+
+    def _commit(self) -> None:
+        """POSTs the filled form, leaves the engine on the page ZiHeR redirected to
+
+        :raises EntryRejectedError: when ZiHeR answers with the form instead of saving the entry
+        :raises ZiherError: when ZiHeR redirects to the sign-in page instead
+        """
+        form, self._form = self._form, None
+        try:
+            page = self._submit(form, form["values"], form["page"], commit=True)
+        except requests.HTTPError as err:
+            if err.response.history:  # the POST was answered with a redirect - saved, only the next page failed
+                self._committing = False
+                return
+            if err.response.status_code == 500:  # Rails rolls the entry back on its own error
+                self._committing = False  # a gateway's 502/503/504 says nothing about it - uncertain
+            raise
+        self._page = page
+        if self._signed_out():  # the session expired, ZiHeR didn't take the form
+            self._committing = False
+            raise ZiherError("Signed out by ZiHeR, the entry was not saved")
+        if page.form(FormFieldIDs["date"]) is not None:
+            raise EntryRejectedError(page.errors, page.url)
+
+    def _discard(self) -> None:
+        """Drops the filled form without sending it"""
+        self._form = None
+
+    # HTTP helpers
+
+    def _request(self, method: str, url: str, **kwargs) -> Page:
+        """Sends a request in the session and parses the response"""
+        response = self._session.request(method, url, timeout=self._timeout, **kwargs)
+        if response.status_code != 422:  # Rails answers a rejected form with 422 and the form with errors
+            response.raise_for_status()
+        return Page(response.url, response.text)
+
+    def _get(self, url: str) -> Page:
+        return self._request("get", url)
+
+    def _fetch(self, url: str, check: Callable[[Page], object]) -> Optional[Page]:
+        """Page at `url`, None if it's gone, redirected (e.g. to sign-in page) or fails the `check`"""
+        try:
+            page = self._get(url)
+        except requests.HTTPError:
+            return None
+        return page if page.url == url and check(page) else None
+
+    def _submit(self, form: dict, values: dict, page: Page, commit: bool = False) -> Page:
+        """Sends `form` with the inputs identified by ids in `values` overriden
+
+        :param form: form as returned by `Page.form`
+        :param values: dict mapping input ids to values
+        :param page: page containing the form, its CSRF token is used if the form has none
+        :param commit: include the "commit" submit button in the payload
+        """
+        payload = []
+        for field in form["fields"]:
+            if field["type"] == "submit" and not (commit and field["name"] == "commit"):
+                continue
+            value = values.get(field["id"], field["value"]) if field["id"] else field["value"]
+            payload.append((field["name"], "" if value is None else str(value)))
+        if page.csrf_token and not any(name == "authenticity_token" for name, _ in payload):
+            payload.append(("authenticity_token", page.csrf_token))
+        return self._request("post", form["action"], data=payload)
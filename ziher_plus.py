@@ -1,35 +1,103 @@
 # Driver for automating the importing of Excel data into ZiHeR platform
 # Author: Marek Szymański
-# TODO: add suport for 1% and ROHiS grants
 
+import heapq
+import itertools
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from selenium import webdriver
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.remote.webdriver import WebDriver
-from typing import Optional
+from typing import Callable, Generator, Iterable, Optional
 try:
     from typing import Self  
 except ImportError:
     from typing_extensions import Self  
 
-from zih_loader import iter_data, load_workbook, load_worksheet, print_record
-from site_specific import Locators
+import zih_browsers
+from zih_index import EntryIndex
+from zih_journal import ImportJournal
+from zih_metrics import RunMetrics
+from zih_pacing import AdaptivePacer
+from zih_review import review
+from zih_loader import ERROR_KEY, iter_data, load_workbook, load_worksheet, print_record
+from site_specific import Locators, SiteURL, FormFieldIDs, LogbookTable
+from zih_errors import FAILURE_KINDS, EntryRejectedError, InvalidRecordError, MissingFieldsError, ZiherError
+from zih_scripts import FILL_FORM, PAGE_LOAD_TIME, SCRAPE_ROWS
+from zih_session import SessionCache
+from zih_validate import print_issues, validate_range
+from zih_watch import FileWatcher, RowTracker, file_stamp
+from zih_waits import DEFAULT_TIMEOUTS, click_and_wait, wait_clickable, wait_loaded, wait_visible
 from zih_types import ZihRecord, LogbookType, EntryType
 
 
 class ZiherPlus:
     '''Automation driver for ZiHeR
     
-    :param driver: selenium.WebDriver to be used, configure as needed, but will override implicit waits
+    :param driver: selenium.WebDriver to be used, configure as needed, but will turn implicit waits off
     :param human_control: will the procces be controlled by human or fully automated
+    :param review: instead of approving records one by one, during sending, review all of them
+                   at once before sending (see zih_review.py) - approved ones are then sent unattended
+    :param review_report: with `review`, also save the records as an HTML report to this path
+    :param pacer: AdaptivePacer spacing out the records by ZiHeR's latency and failures (see zih_pacing.py),
+                  the chosen pace is printed at the end of every `send`
     :param filename: use to immediately load workbook
     :param sheetname: use to immediately load worksheet
+    :param base_url: address of the ZiHeR instance, change to use a local stand-in server
+    :param timeouts: per-step wait timeouts in seconds, overriding chosen DEFAULT_TIMEOUTS from zih_waits.py
+    :param streaming: load workbooks read-only and stream their rows, for big multi-sheet files
+    :param cache: directory for caching parsed worksheets (see zih_sources.py),
+                  with it re-runs on an unchanged file don't parse it again
+    :param journal: path of the import journal (see zih_journal.py), with it commited records
+                    are recorded and skipped when the same rows are sent again
+    :param session_cache: directory for saving login cookies (see zih_session.py),
+                          with it `login` reuses the previous run's session while it's valid
+    :param prefetch: with human control, prepare the next record's form in a second tab
+                     while the current one is being reviewed
+    :param metrics: RunMetrics timing each stage of each record (see zih_metrics.py),
+                    its summary is printed at the end of every `send`
+    :param retries: how many more times a record failing for a passing reason (see FAILURE_KINDS
+                    in zih_errors.py) is tried, the driver is brought back to the logbook after each failure
+    :param backoff: seconds before the first retry of a record, doubled with each next one,
+                    other records are sent in the meantime
     
     :ivar driver: selenium.WebDriver used to operate the browser
-    :ivar __region: ZiHeR regional subdomain
-    :ivar __human_control: is the driver human-supervised
+    :ivar _base_url: address of the ZiHeR instance
+    :ivar _timeouts: wait timeouts in use
+    :ivar report: outcome of each record of the last `send`, list of {"IDX", "status", "error", "kind", "attempts"}
+                  dicts, where status is one of "sent", "skipped" or "failed", and kind is the kind of failure
+    :ivar gave_up: records of the last `send` which failed for good, like in `report`
+    :ivar startup_time: seconds the browser took to start, if started by `Chrome` or `Firefox`
+    :ivar _region: ZiHeR regional subdomain
+    :ivar __human_control: is the driver human-supervised, record by record
+    :ivar _review: are records reviewed all at once before sending
+    :ivar _review_report: path of the HTML report for the review, if any
+    :ivar __streaming: are workbooks loaded in streaming mode
+    :ivar __filename: path of the loaded workbook
+    :ivar __cache: directory of the parsed worksheets cache, if any
+    :ivar _journal: ImportJournal in use, if any
+    :ivar _session_cache: SessionCache in use, if any
+    :ivar _email: account signed in with `login`
+    :ivar _prefetch: is the next form prepared during human review
+    :ivar _metrics: RunMetrics in use, if any
+    :ivar _retries: retries of a failed record
+    :ivar _backoff: delay of the first retry, in seconds
+    :ivar __credentials: email and password from `login`, for signing in again when the session expires
+    :ivar _committing: is the entry being commited, see `_commit_entry`
+    :ivar _commit_latency: seconds the last commit took, until the next page was ready
+    :ivar _pacer: AdaptivePacer in use, if any
+    :ivar _lost: kind of the failure the driver couldn't recover from yet, None if it's on a known page
+    :ivar _logbook: logbook opened last
+    :ivar _urls: addresses of the logbooks and their new entry forms learned so far,
+                 {(region, logbook): {"log", "income", "cost"}}
     :ivar __workbook: Excel workbook - the data source
+    :ivar __workbooks: every workbook loaded so far with its file's `file_stamp`, by path
     :ivar __worksheet: specific worksheet of the __workbook 
+    :ivar __positions: position of each record of the current `send` by its id, see `__numbered`
+    :ivar __report_positions: positions of the records reported in `report`, in the same order
 
     
     '''
@@ -44,15 +112,56 @@ class ZiherPlus:
         human_control: bool = True,
         filename: Optional[str] = None,
         sheetname: Optional[str] = None,
+        base_url: str = SiteURL,
+        timeouts: Optional[dict[str, float]] = None,
+        streaming: bool = False,
+        cache: Optional[str] = None,
+        journal: Optional[str] = None,
+        session_cache: Optional[str] = None,
+        prefetch: bool = False,
+        metrics: Optional[RunMetrics] = None,
+        retries: int = 2,
+        backoff: float = 1.0,
+        review: bool = False,
+        review_report: Optional[str] = None,
+        pacer: Optional[AdaptivePacer] = None,
     ):
         self._driver = driver
-        self.__human_control = human_control
-        self.__workbook = filename
-        self.__worksheet = sheetname
+        self._base_url = base_url.rstrip("/")
+        self._timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self._region = None
+        self._email = None
+        self.__human_control = human_control and not review
+        self._review = review
+        self._review_report = review_report
+        self.__streaming = streaming
+        self.__filename = filename
+        self.__cache = cache
+        self._journal = ImportJournal(journal) if journal else None
+        self._session_cache = SessionCache(session_cache) if session_cache else None
+        self._prefetch = prefetch
+        self._metrics = metrics
+        self._retries = retries
+        self._backoff = backoff
+        self.__credentials = None
+        self._committing = False
+        self._commit_latency = None
+        self._pacer = pacer
+        self._lost = None
+        self.__workbook = None
+        self.__worksheet = None
+        self.__workbooks = {}
+        self._logbook = None
+        self._urls = {}
+        self.report = []
+        self.gave_up = []
+        self.startup_time = None
+        self.__positions = {}
+        self.__report_positions = []
 
-        self._driver.implicitly_wait(15)
+        self._setup_driver()
         if filename:
-            self.__workbook, self.__worksheet = load_workbook(filename, sheetname)
+            self.load(filename, sheetname)
 
     def quit(self) -> None:
         '''Closes ZiherPlus and the controlled browser
@@ -61,24 +170,34 @@ class ZiherPlus:
         and not ZiherPlus.
         '''
         self._driver.quit()
+        self._close_workbooks()
 
     def login(self, email: str, password: str, region: str = "pomorze") -> Self:
         """Log into ziher using the provided credentials
 
         Can be run from anywhere, because it uses direct GET.
         If succesful leaves the driver on the welcome page, signed in.
+        With a session cache, first tries to restore the saved session of this account
+        and only signs in if ZiHeR doesn't accept it.
 
         :param email: email used for signing in
         :param password: password for signing in
         :param region: regional subdomain to use
         """
-        self._driver.get(f"https://ziher.zhr.pl/{region}/users/sign_in")
+        self._region = region
+        self._email = email
+        self.__credentials = (email, password)
 
-        self._driver.find_element(*Locators["Login"]["MailInput"]).send_keys(email)
-        self._driver.find_element(*Locators["Login"]["PasswordInput"]).send_keys(
-            password
-        )
-        self._driver.find_element(*Locators["Login"]["LoginButton"]).click()
+        if self._session_cache:
+            cookies = self._session_cache.load(region, email)
+            if cookies and self._restore_session(cookies):
+                print(f"Restored saved session of {email}")
+                return self
+            self._session_cache.invalidate(region, email)
+
+        self._sign_in(email, password, region)
+        if self._session_cache:
+            self._session_cache.save(region, email, self._get_cookies())
 
         return self
 
@@ -89,20 +208,34 @@ class ZiherPlus:
         Leaves the driver on the ziher login page.
         Ends method chaining.
         """
-        # self.__driver.find_element(*Locators["Site"]["AccountMenuDropdownLink"]).click()
-        # self.__driver.find_element(*Locators["Site"]["LogoutLink"]).click()
-
-        self.__use_dropdown(dropdown_text="@zhr.pl", option_text="Wyloguj się")
+        if self._session_cache and self._email:
+            self._session_cache.invalidate(self._region, self._email)
+        self._sign_out()
+        return self
 
     def load(self, filename: str, sheetname: Optional[str] = None) -> Self:
         """Loads the Excel file: `filename` and optionally opens worksheet `sheetname` or the active one
 
-        :param filename: path to Excel file
+        Workbooks stay open for the whole session: loading a file again only switches
+        the worksheet, unless the file has been modified since (its `file_stamp` differs,
+        the same check `watch` uses).
+
+        :param filename: path to Excel file, or its .csv/.ods export
         :param sheetname: worksheet to open, leave out to open the active one
         """
-        if self.__workbook:
-            self.__workbook.close()
-        self.__workbook, self.__worksheet = load_workbook(filename, sheetname)
+        path = os.path.abspath(filename)
+        stamp = file_stamp(filename)
+        if stamp is None:
+            raise FileNotFoundError(f"Can't read {filename}")
+        if path in self.__workbooks and self.__workbooks[path][0] == stamp:
+            self.__workbook = self.__workbooks[path][1]
+            self.__worksheet = load_worksheet(self.__workbook, sheetname)
+        else:
+            if path in self.__workbooks:
+                self.__workbooks[path][1].close()
+            self.__workbook, self.__worksheet = load_workbook(filename, sheetname, self.__streaming, self.__cache)
+            self.__workbooks[path] = (stamp, self.__workbook)
+        self.__filename = filename
         return self
 
     def worksheet(self, sheetname: Optional[str] = None) -> Self:
@@ -117,17 +250,24 @@ class ZiherPlus:
         self,
         logbook: LogbookType,
         min_row: int,
-        max_row: int,
+        max_row: Optional[int] = None,
         sheetname: Optional[str] = None,
-        filename: Optional[str] = None
+        filename: Optional[str] = None,
+        skip_existing: bool = False,
+        validate: bool = True,
     ) -> Self:
         '''Import Excel data into ziher
 
+        With `validate` the whole row range is checked first (see `validate`)
+        and nothing is sent if any row has errors.
+
         :param logbook: string identifying targeted logbook
         :param min_row: nr of the first row of data to be imported
-        :param max_row: nr of the last row of data to be imported
+        :param max_row: nr of the last row of data to be imported, leave out to import until the end of data
         :param sheetname: use to change worksheet
         :param filename: use to change Excel file
+        :param skip_existing: read the logbook first and leave out records already in it
+        :param validate: check the rows before sending anything
         '''
 
         if filename:
@@ -135,46 +275,203 @@ class ZiherPlus:
         elif sheetname:
             self.worksheet(sheetname)
 
-        self.__open_log(logbook)
+        if validate:
+            issues = self.validate(min_row, max_row)
+            if any(x["level"] == "error" for x in issues):
+                print("Nothing sent - fix the errors or send with validate=False")
+                self.report = []
+                return self
 
-        for i, record in enumerate(iter_data(self.__worksheet, min_row, max_row)):
-            if self.__human_control:
-                print_record(record, i)
-            else:
-                print(f"Record {i} - from Excel {record['IDX']}")
+        records = iter_data(self.__worksheet, min_row, max_row)
+        if self._journal:
+            records = list(self._journal.pending(self.__filename, self.__worksheet.title, records))
+            if self._journal.skipped:
+                print(f"Skipping {self._journal.skipped} records already in the journal")
 
+        return self.send_records(logbook, records, skip_existing)
+
+    def send_records(
+        self, logbook: LogbookType, records: Iterable[ZihRecord], skip_existing: bool = False
+    ) -> Self:
+        '''Import already loaded `records` into ziher
+
+        In `review` mode all of them are shown first and only the approved ones are sent,
+        the rest is reported as skipped.
+
+        :param logbook: string identifying targeted logbook
+        :param records: records as yielded by `iter_data`
+        :param skip_existing: read the logbook first and leave out records already in it
+        '''
+        self.report = []
+        self.gave_up = []
+        self.__positions = {}
+        self.__report_positions = []
+        records = self.__numbered(records)
+        if self._metrics:
+            self._metrics.start_run(logbook=logbook, engine=type(self).__name__)
+        if self._pacer:
+            self._pacer.start_run()
+        with self._stage("open_log"):
             try:
-                self.__fill_form(record)
+                self._open_log(logbook)
             except Exception as err:
-                print(f"Error: {type(err)}")
-                if self.__human_control:
-                    print(err)
-            
-            time.sleep(2)
+                if self._classify(err) != "session" or not self._recover("session", logbook):
+                    raise
+
+        if skip_existing:
+            with self._stage("index_log"):
+                index = self.index_log()
+            records = list(index.missing(records))
+            print(f"{len(index)} entries in the logbook, skipping {index.skipped} records already there")
+
+        if self._review:
+            records = list(records)
+            with self._stage("review_all"):
+                approved = review(records, self._review_report)
+            ids = {id(r) for r in approved}
+            for record in records:
+                if id(record) not in ids:
+                    self._finish_record(record, "skipped")
+            records = approved
+
+        if self.__human_control and self._prefetch:
+            self._send_prefetching(records)
+        else:
+            self._send_retrying(records)
 
+        # review and retries report records out of order, `report` follows the rows
+        order = sorted(range(len(self.report)), key=lambda i: self.__report_positions[i])
+        self.report = [self.report[i] for i in order]
+        self.gave_up = [r for r in self.report if r["status"] == "failed"]
+        if self.gave_up:
+            print("Gave up on records: " + ", ".join(f"{r['IDX']} ({r['kind']})" for r in self.gave_up))
+        if self._pacer:
+            self._pacer.print_summary()
+        if self._metrics:
+            self._metrics.print_summary(self._metrics.end_run(
+                logbook=logbook, **({"pacing": self._pacer.summary()} if self._pacer else {})))
+        return self
+
+    def validate(self, min_row: int, max_row: Optional[int] = None) -> list[dict]:
+        '''Checks rows of the loaded worksheet before sending, prints and returns found issues
+
+        Runs on the spreadsheet alone - no browser or ZiHeR involved.
+        Formulas (e.g. of the AGGREGATES columns) are checked by the values Excel saved for them.
+        See `zih_validate.validate_range` for the checks and the report format.
+
+        :param min_row: nr of the first row of data to be checked
+        :param max_row: nr of the last row of data to be checked, leave out to check until the end of data
+        '''
+        issues = self._validate_range(min_row, max_row)
+        if issues:
+            print_issues(issues)
+        return issues
+
+    def index_log(self) -> EntryIndex:
+        '''Reads every page of the opened logbook into an index of its entries
+
+        Leaves the driver back on the first page of the logbook.
+        '''
+        return EntryIndex(self._scrape_log())
+
+    def watch(
+        self,
+        logbook: LogbookType,
+        min_row: int,
+        filename: Optional[str] = None,
+        sheetname: Optional[str] = None,
+        interval: float = 5.0,
+        settle: float = 2.0,
+        keepalive: Optional[float] = 300.0,
+        initial: bool = True,
+        validate: bool = True,
+        max_imports: Optional[int] = None,
+    ) -> Self:
+        '''Keeps importing records appended to or edited in the workbook, until interrupted (Ctrl+C)
+
+        The file is checked every `interval` seconds. When it changes, it's loaded again and only
+        the records which are new, or edited since they were imported, are sent (told by "IDX"
+        and `record_hash`, see zih_watch.py) - all in this session, which is kept signed in
+        between the changes. With a journal, records already in it count as imported.
+        An edited record is sent as a new entry - its old entry has to be removed from ZiHeR by hand.
+        Records which failed are tried again after the next change of the file,
+        the ones not approved in review - only once they're edited.
+
+        :param logbook: string identifying targeted logbook
+        :param min_row: nr of the first row of data, rows are read until the end of data
+        :param filename: workbook to watch, leave out to watch the loaded one
+        :param sheetname: worksheet to watch, leave out for the loaded (or active) one
+        :param interval: seconds between checks of the file
+        :param settle: seconds the changed file must stay unchanged before it's read
+        :param keepalive: seconds without imports after which ZiHeR is visited, so the session
+                          doesn't expire (it's signed in again if it did), None to never visit
+        :param initial: import the records already in the workbook, otherwise they count
+                        as imported and only the later changes are sent
+        :param validate: check the changed rows first and send nothing while any of them has errors
+        :param max_imports: stop after this many imports, leave out to watch until interrupted
+        '''
+        if not filename:
+            if not self.__filename:
+                raise ValueError("No workbook to watch - load one or pass filename")
+            filename = self.__filename
+            sheetname = sheetname or self.__worksheet.title
+        watcher = FileWatcher(filename, settle)
+        tracker = RowTracker()
+        imports = 0
+        active = time.monotonic()
+        print(f"Watching {filename}, Ctrl+C to stop")
+
+        try:
+            while max_imports is None or imports < max_imports:
+                if watcher.changed():
+                    try:
+                        self.load(filename, sheetname)
+                        records = list(iter_data(self.__worksheet, min_row))
+                    except Exception as err:
+                        print(f"Can't read {filename}, waiting for the next change: {type(err).__name__}: {err}")
+                    else:
+                        sheetname = self.__worksheet.title
+                        if not initial:
+                            tracker.mark(records)
+                            initial = True
+                        else:
+                            try:
+                                if self._import_changes(logbook, min_row, records, tracker, validate):
+                                    imports += 1
+                            except Exception as err:
+                                print(f"Import failed, trying again after the next change: {type(err).__name__}: {err}")
+                        active = time.monotonic()
+                elif keepalive is not None and time.monotonic() - active > keepalive:
+                    self._keep_alive()
+                    active = time.monotonic()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("Stopped watching")
         return self
 
     # Convenience constructors for different browsers
 
     @classmethod
-    def Firefox(cls, human_control: bool = True):
-        '''ZiherPlus driver for Firefox'''
-        return cls(webdriver.Firefox(), human_control)
+    def Firefox(cls, human_control: bool = True, fast: bool = False, headless: Optional[bool] = None,
+                profile_dir: Optional[str] = None, **kwargs):
+        '''ZiherPlus driver for Firefox, see `_launch` for the browser options'''
+        return cls._launch(zih_browsers.firefox, human_control, fast, headless, profile_dir, **kwargs)
 
     @classmethod
-    def Chrome(cls, human_control: bool = True):
-        '''ZiherPlus driver for Chrome'''
-        return cls(webdriver.Chrome(), human_control)
+    def Chrome(cls, human_control: bool = True, fast: bool = False, headless: Optional[bool] = None,
+               profile_dir: Optional[str] = None, **kwargs):
+        '''ZiherPlus driver for Chrome, see `_launch` for the browser options'''
+        return cls._launch(zih_browsers.chrome, human_control, fast, headless, profile_dir, **kwargs)
 
     @classmethod
-    def Edge(cls, human_control: bool = True):
+    def Edge(cls, human_control: bool = True, **kwargs):
         '''ZiherPlus driver for MSEdge'''
-        return cls(webdriver.Edge(), human_control)
+        return cls(webdriver.Edge(), human_control, **kwargs)
 
     @classmethod
-    def Safari(cls, human_control: bool = True):
+    def Safari(cls, human_control: bool = True, **kwargs):
         '''ZiherPlus driver for Safari'''
-        return cls(webdriver.Safari(), human_control)
+        return cls(webdriver.Safari(), human_control, **kwargs)
         
 
 
@@ -182,55 +479,563 @@ class ZiherPlus:
     # Private methods
     # ==========================================================
 
-    def __open_log(self, book: LogbookType):
+    @classmethod
+    def _launch(
+        cls,
+        browser: Callable[..., WebDriver],
+        human_control: bool = True,
+        fast: bool = False,
+        headless: Optional[bool] = None,
+        profile_dir: Optional[str] = None,
+        **kwargs,
+    ):
+        """Starts `browser` (see zih_browsers.py) and a driver using it, reports how long the start took
+
+        :param fast: use the lean profile - no images, fonts or media, pages ready once their HTML is
+        :param headless: run the browser without a window, by default only when fast and
+                         nobody has to look at the forms (no `human_control`, or `review` mode)
+        :param profile_dir: browser profile directory to reuse between runs
+        """
+        if headless is None:
+            headless = fast and (not human_control or kwargs.get("review", False))
+        started = time.perf_counter()
+        driver = browser(fast=fast, headless=headless, profile_dir=profile_dir)
+        zp = cls(driver, human_control=human_control, **kwargs)
+        zp.startup_time = time.perf_counter() - started
+        print(f"Browser started in {zp.startup_time:.2f} s" + (" (fast profile)" if fast else ""))
+        if zp._metrics:
+            zp._metrics.emit("startup", browser=browser.__name__, fast=fast, headless=headless,
+                             duration=round(zp.startup_time, 3))
+        return zp
+
+    def _send_record(self, record: ZihRecord, nr: Optional[int] = None, attempt: int = 1) -> dict:
+        """Opens, fills and commits form for a single `record`, never raises
+
+        After a failure the driver is brought back to the logbook, so the next record
+        starts from a known page.
+
+        :param record: record as yielded by `iter_data`
+        :param nr: index of the record in current context
+        :param attempt: which time the record is tried
+
+        :returns: outcome of the record, also appended to `report` - unless its status is "retry",
+                  meaning it failed for a passing reason and should be tried again later
+        """
+        if self._metrics:
+            self._metrics.start_record(record, nr)
+        if self.__human_control:
+            print_record(record, nr)
+        else:
+            print(f"Record {nr} - from Excel {record.get('IDX')}" + (f" (attempt {attempt})" if attempt > 1 else ""))
+
+        if record.get(ERROR_KEY):
+            return self._finish_record(record, "failed", InvalidRecordError(record[ERROR_KEY]), attempt=attempt)
+        if self._lost:
+            with self._stage("recover"):
+                self._recover(self._lost)
+        if self._pacer:
+            with self._stage("pace"):
+                self._pacer.wait()
+        self._committing = False
+        self._commit_latency = None
+        try:
+            committed = self._fill_form(record)
+        except Exception as err:
+            kind = self._classify(err)
+            if self._committing and kind in ("stale", "timeout", "network"):
+                kind = "uncertain"
+            if self._pacer:
+                self._pacer.record(kind=kind)
+            with self._stage("recover"):
+                self._recover(kind)
+            status = "retry" if FAILURE_KINDS[kind] and attempt <= self._retries else "failed"
+            return self._finish_record(record, status, err, kind, attempt)
+        if self._pacer:
+            self._pacer.record(latency=self._commit_latency)
+        return self._finish_record(record, "sent" if committed else "skipped", attempt=attempt)
+
+    def _finish_record(
+        self,
+        record: ZihRecord,
+        status: str = "failed",
+        err: Optional[Exception] = None,
+        kind: Optional[str] = None,
+        attempt: int = 1,
+    ) -> dict:
+        """Reports the outcome of the `record` - prints the error, journals commited records
+
+        :returns: outcome of the record, also appended to `report` unless it's to be retried
+        """
+        result = {"IDX": record.get("IDX"), "status": status, "error": None, "kind": None, "attempts": attempt}
+        if err is not None:
+            result["kind"] = kind or self._classify(err)
+            print(f"Error ({result['kind']}): {type(err)}")
+            if self.__human_control:
+                print(err)
+            result["error"] = f"{type(err).__name__}: {err}"
+
+        if result["status"] == "sent" and self._journal and self.__filename:
+            self._journal.add(self.__filename, self.__worksheet.title, record)
+        if self._metrics:
+            self._metrics.end_record(result["status"], result["error"])
+        if result["status"] != "retry":
+            self.report.append(result)
+            self.__report_positions.append(self.__positions.get(id(record), len(self.__positions)))
+        return result
+
+    def __numbered(self, records: Iterable[ZihRecord]) -> Generator[ZihRecord, None, None]:
+        """Yields `records`, noting the position of each in `__positions` -
+        by its id, which stays unique while the record is being sent"""
+        for nr, record in enumerate(records):
+            self.__positions[id(record)] = nr
+            yield record
+
+    def _send_retrying(self, records: Iterable[ZihRecord]) -> None:
+        """Sends `records` one by one, trying failed ones again once their backoff delay passes
+
+        Records due for a retry are sent between the others, so waiting for them
+        costs nothing until only they are left.
+        """
+        retries = []  # heap of (due time, order, attempt, nr, record)
+        order = itertools.count()
+
+        def send(nr: int, record: ZihRecord, attempt: int):
+            result = self._send_record(record, nr, attempt)
+            if result["status"] == "retry":
+                due = time.monotonic() + self._retry_delay(attempt)
+                heapq.heappush(retries, (due, next(order), attempt + 1, nr, record))
+
+        for nr, record in enumerate(records):
+            send(nr, record, 1)
+            while retries and retries[0][0] <= time.monotonic():
+                _, _, attempt, nr, record = heapq.heappop(retries)
+                send(nr, record, attempt)
+
+        while retries:
+            due, _, attempt, nr, record = heapq.heappop(retries)
+            time.sleep(max(0.0, due - time.monotonic()))
+            send(nr, record, attempt)
+
+    def _retry_delay(self, attempt: int) -> float:
+        """Seconds to wait before trying again a record which failed its `attempt`"""
+        return self._backoff * 2 ** (attempt - 1)
+
+    def _classify(self, err: Exception) -> str:
+        """Kind of failure `err` means, one of FAILURE_KINDS"""
+        if isinstance(err, EntryRejectedError):
+            return "rejected"
+        if isinstance(err, MissingFieldsError):
+            return "fields"
+        if isinstance(err, InvalidRecordError):
+            return "invalid"
+        try:
+            if self._signed_out():
+                return "session"
+        except Exception:
+            pass
+        if isinstance(err, StaleElementReferenceException):
+            return "stale"
+        if isinstance(err, TimeoutException):
+            return "timeout"
+        return "other"
+
+    def _recover(self, kind: str, logbook: Optional[LogbookType] = None) -> bool:
+        """Brings the driver back to the logbook after a failure of `kind`,
+        signing in again first if ZiHeR signed it out. Never raises - when it fails,
+        it's tried again before the next record.
+
+        :param logbook: logbook to open, leave out for the one opened last
+
+        :returns: did it work
+        """
+        logbook = logbook or self._logbook
+        try:
+            if kind == "session" and self.__credentials:
+                self._sign_in(*self.__credentials, self._region)
+                if self._session_cache:  # the saved cookies are dead, keep the new session instead
+                    self._session_cache.save(self._region, self._email, self._get_cookies())
+            if logbook:
+                if self._cached_url("log") is None:
+                    self._go_home()
+                self._open_log(logbook)
+        except Exception as err:
+            print(f"Recovery failed: {type(err).__name__}: {err}")
+            self._lost = kind
+            return False
+        self._lost = None
+        return True
+
+    def _import_changes(
+        self, logbook: LogbookType, min_row: int, records: list[ZihRecord], tracker: RowTracker, validate: bool
+    ) -> bool:
+        """Sends the `records` of the loaded worksheet (from `min_row`) which `tracker` doesn't know
+        as imported, marking the ones which got through (or were left out in review)
+
+        :returns: was anything sent
+        """
+        if self._journal:
+            tracker.mark(r for r in records if self._journal.is_commited(self.__filename, self.__worksheet.title, r))
+        new, edited = tracker.changes(records)
+        if not new and not edited:
+            print("No new or edited records")
+            return False
+        print(f"{len(new)} new and {len(edited)} edited records")
+        if edited:
+            print("Edited records are sent as new entries, remove their old entries from ZiHeR: "
+                  + ", ".join(str(r.get("IDX")) for r in edited))
+
+        ids = {id(r) for r in new + edited}
+        changed = [r for r in records if id(r) in ids]
+        if validate:
+            idxs = {str(r.get("IDX")) for r in changed}
+            issues = [x for x in self._validate_range(min_row) if str(x["IDX"]) in idxs]
+            if issues:
+                print_issues(issues)
+            if any(x["level"] == "error" for x in issues):
+                print("Nothing sent - waiting for the errors to be fixed")
+                return False
+
+        self.send_records(logbook, changed)
+        done = {str(r["IDX"]) for r in self.report if r["status"] != "failed" or r["kind"] == "uncertain"}
+        tracker.mark(r for r in changed if str(r.get("IDX")) in done)
+        return True
+
+    def _validate_range(self, min_row: int, max_row: Optional[int] = None) -> list[dict]:
+        """`validate_range` of the loaded worksheet, on the values of its formulas
+
+        Workbooks loaded without streaming hold formulas as text ("=SUM(E2:H2)"),
+        then the values Excel saved for them are read from a read-only view of the file.
+        """
+        if getattr(self.__workbook, "_data_only", True):
+            return validate_range(self.__worksheet, min_row, max_row)
+        wb, ws = load_workbook(self.__filename, self.__worksheet.title, streaming=True)
+        try:
+            return validate_range(ws, min_row, max_row)
+        finally:
+            wb.close()
+
+    def _keep_alive(self) -> None:
+        """Visits ZiHeR so the idle session doesn't expire, signs in again if it already has"""
+        try:
+            self._go_home()
+            if self._signed_out():
+                self._recover("session")
+        except Exception as err:
+            print(f"Keeping the session alive failed: {type(err).__name__}: {err}")
+
+    def _stage(self, name: str):
+        """Context manager timing stage `name` of the current record, if metrics are on"""
+        return self._metrics.stage(name) if self._metrics else nullcontext()
+
+    def _send_prefetching(self, records: Iterable[ZihRecord]) -> None:
+        """Human-controlled sending with the next form always ready in the other tab
+
+        While the answer to the commit question is awaited (in a helper thread),
+        the next record's form is opened and filled in the second tab, then the
+        tab under review is brought back. After the answer the current form is
+        commited or left, and the tabs swap roles, so the reviewer gets the next
+        form without waiting for it to load.
+        """
+        records = enumerate(records)
+        log_url = self._driver.current_url
+        tabs = [self._driver.current_window_handle]
+        self._driver.switch_to.new_window("tab")
+        tabs.append(self._driver.current_window_handle)
+        self._driver.get(log_url)
+        self._driver.switch_to.window(tabs[0])
+
+        def prepare(item):
+            """Opens and fills form for the (nr, record) `item` in the active tab"""
+            if item[1].get(ERROR_KEY):
+                return (*item, InvalidRecordError(item[1][ERROR_KEY]))
+            try:
+                with self._stage("prefetch"):
+                    self._open_form(item[1]["type"])
+                    self._fill_fields(item[1])
+            except Exception as err:
+                self._driver.get(log_url)  # don't leave the tab on a half-filled form
+                return (*item, err)
+            return (*item, None)
+
+        current = next(records, None)
+        current = prepare(current) if current else None
+        active = 0
+        with ThreadPoolExecutor(max_workers=1) as reviewer:
+            while current:
+                nr, record, err = current
+                if self._metrics:
+                    self._metrics.start_record(record, nr)
+                print_record(record, nr)
+                answer = reviewer.submit(input, self._COMMIT_PROMPT) if err is None else None
+
+                upcoming = next(records, None)
+                if upcoming:
+                    self._driver.switch_to.window(tabs[1 - active])
+                    upcoming = prepare(upcoming)
+                    self._driver.switch_to.window(tabs[active])
+
+                if answer is None:
+                    self._finish_record(record, err=err)
+                else:
+                    try:
+                        with self._stage("review"):
+                            commit = answer.result() == "y"
+                        if commit:
+                            self._finish_record(record, "sent" if self._commit_entry() else "skipped")
+                        else:
+                            with self._stage("discard"):
+                                self._discard()
+                            self._finish_record(record, "skipped")
+                    except Exception as commit_err:
+                        self._driver.get(log_url)
+                        self._finish_record(record, err=commit_err)
+
+                active = 1 - active
+                self._driver.switch_to.window(tabs[active])
+                current = upcoming
+
+        self._driver.switch_to.window(tabs[1 - active])
+        self._driver.close()
+        self._driver.switch_to.window(tabs[active])
+
+    # Page primitives - overriden by other engines (see ziher_http.py)
+
+    def _close_workbooks(self) -> None:
+        """Closes every workbook loaded in this session"""
+        for _, wb in self.__workbooks.values():
+            wb.close()
+        self.__workbooks = {}
+
+    def _setup_driver(self) -> None:
+        """Prepares the freshly passed driver for use"""
+        self._driver.implicitly_wait(0)  # every lookup waits explicitly, see zih_waits.py
+
+    def _sign_in(self, email: str, password: str, region: str) -> None:
+        """Fills and sends the sign-in form"""
+        self._driver.get(f"{self._base_url}/{region}/users/sign_in")
+
+        wait_visible(self._driver, Locators["Login"]["MailInput"], self._timeouts["page"]).send_keys(email)
+        self._driver.find_element(*Locators["Login"]["PasswordInput"]).send_keys(
+            password
+        )
+        click_and_wait(
+            self._driver,
+            self._driver.find_element(*Locators["Login"]["LoginButton"]),
+            self._timeouts["page"],
+        )
+
+    def _sign_out(self) -> None:
+        """Logs out using the account dropdown"""
+        # self.__driver.find_element(*Locators["Site"]["AccountMenuDropdownLink"]).click()
+        # self.__driver.find_element(*Locators["Site"]["LogoutLink"]).click()
+
+        self.__use_dropdown(dropdown_text="@zhr.pl", option_text="Wyloguj się")
+
+    def _get_cookies(self) -> list[dict]:
+        """Cookies of the current session"""
+        return self._driver.get_cookies()
+
+    def _signed_out(self) -> bool:
+        """Is the driver on the sign-in page"""
+        return "users/sign_in" in self._driver.current_url
+
+    def _go_home(self) -> None:
+        """Opens the welcome page of the region"""
+        self._driver.get(f"{self._base_url}/{self._region}/")
+
+    def _restore_session(self, cookies: list[dict]) -> bool:
+        """Loads saved `cookies` into the browser and opens the welcome page with them
+
+        :returns: is the session still valid - if not, the driver is left on the sign-in page
+        """
+        # cookies can only be set for the domain of the opened page, any light one will do
+        self._driver.get(f"{self._base_url}/robots.txt")
+        for cookie in cookies:
+            self._driver.add_cookie(cookie)
+        self._driver.get(f"{self._base_url}/{self._region}/")
+        return "users/sign_in" not in self._driver.current_url
+
+    def _open_log(self, book: LogbookType):
         """Switch to another logbook
 
+        Goes straight to the logbook's address, if it's known already,
+        otherwise clicks its link and learns the addresses of the logbook and its forms.
+
         :param book: string identifying logbook
         """
-        if book == "bankowa":
-            self._driver.find_element(*Locators["Site"]["BankLogLink"]).click()
-        elif book == "finansowa":
-            self._driver.find_element(*Locators["Site"]["FinLogLink"]).click()
-        elif book == "inwentarzowa":
-            self._driver.find_element(*Locators["Site"]["InventoryLogLink"]).click()
-
-    def __open_form(self, formtype: EntryType):
+        self._logbook = book
+        url = self._cached_url("log")
+        if url and self._navigate(url, Locators["Site"]["FirstFormButton"]):
+            return
+
+        self._forget_urls()
+        links = {
+            "bankowa": Locators["Site"]["BankLogLink"],
+            "finansowa": Locators["Site"]["FinLogLink"],
+            "inwentarzowa": Locators["Site"].get("InventoryLogLink"),
+        }
+        if links[book] is None:
+            raise ValueError(f"Logbook '{book}' is not supported yet")
+        link = wait_clickable(self._driver, links[book], self._timeouts["element"])
+        click_and_wait(self._driver, link, self._timeouts["page"])
+        if self._signed_out():
+            raise ZiherError("Signed out by ZiHeR")
+
+        self._cache_url("log", self._driver.current_url)
+        for formtype, button in [("income", "FirstFormButton"), ("cost", "SecondFormButton")]:
+            found = self._driver.find_elements(*Locators["Site"][button])
+            if found and found[0].get_attribute("href"):
+                self._cache_url(formtype, found[0].get_attribute("href"))
+
+    def _scrape_log(self) -> list[list[str]]:
+        """Texts of the cells of every entry row, from all pages of the opened logbook"""
+        first_page = self._driver.current_url
+        rows = []
+        while True:
+            rows += self._driver.execute_script(SCRAPE_ROWS, LogbookTable["Rows"])
+            next_page = self._driver.find_elements(*LogbookTable["NextPageLink"])
+            if not next_page:
+                break
+            click_and_wait(self._driver, next_page[0], self._timeouts["page"])
+
+        if self._driver.current_url != first_page:
+            self._driver.get(first_page)
+        return rows
+
+    def _open_form(self, formtype: EntryType):
         """Opens correct form - either for declaring income or cost
 
+        Goes straight to the form's address, if it's known already, otherwise
+        clicks its button on the logbook page - reopening the logbook if the known address failed.
+
         :param formtype: which form to open
         """
-        if formtype == "income":
-            self._driver.find_element(*Locators['Site']['FirstFormButton']).click()
-        elif formtype == "cost":
-            self._driver.find_element(*Locators['Site']['SecondFormButton']).click()
+        url = self._cached_url(formtype)
+        if url:
+            if self._navigate(url, (By.ID, FormFieldIDs['date'])):
+                self._add_page_load()
+                return
+            self._forget_urls()
+            self._open_log(self._logbook)
+
+        buttons = {
+            "income": Locators['Site']['FirstFormButton'],
+            "cost": Locators['Site']['SecondFormButton'],
+        }
+        button = wait_clickable(self._driver, buttons[formtype], self._timeouts["element"])
+        click_and_wait(self._driver, button, self._timeouts["page"])
+        wait_visible(self._driver, (By.ID, FormFieldIDs['date']), self._timeouts["form"])
+        self._add_page_load()
+
+    def _add_page_load(self) -> None:
+        """Adds the browser's own timing of the current page load to the metrics, as stage "page_load" """
+        if self._metrics:
+            duration = self._driver.execute_script(PAGE_LOAD_TIME)
+            if duration is not None:
+                self._metrics.add("page_load", duration)
+
+    def _navigate(self, url: str, expected: tuple[str, str]) -> bool:
+        """Opens `url` directly and tells if it's still the right page - not a redirect
+        (e.g. to sign-in page) and with element at `expected` locator on it"""
+        self._driver.get(url)
+        wait_loaded(self._driver, self._timeouts["page"])
+        if self._driver.current_url.split("#")[0] != url.split("#")[0]:
+            return False
+        return bool(self._driver.find_elements(*expected))
 
-    def __fill_form(self, entry_data: ZihRecord):
+    def _cached_url(self, name: str) -> Optional[str]:
+        """Learned address of the opened logbook ("log") or of its form ("income", "cost"), None if unknown"""
+        return self._urls.get((self._region, self._logbook), {}).get(name)
+
+    def _cache_url(self, name: str, url: str) -> None:
+        """Remembers `url` as the address `name` of the opened logbook, see `_cached_url`"""
+        self._urls.setdefault((self._region, self._logbook), {})[name] = url
+
+    def _forget_urls(self) -> None:
+        """Drops learned addresses of the opened logbook, after one of them stopped working"""
+        self._urls.pop((self._region, self._logbook), None)
+
+    def _fill_form(self, entry_data: ZihRecord) -> bool:
         """Opens, fills and commits new form with provided single `entry_data`
 
         :param entry_data: dict conatining input_ids, respective input values
                            and other info that's not sent to the form
-        """
-        self.__open_form(entry_data["type"])
 
-        for k, v in entry_data.items():
-            if k in ["type", "category", "IDX"]:
-                continue
-            self._driver.find_element(By.ID, k).send_keys(v)
+        :returns: was the entry commited
+        """
+        with self._stage("open_form"):
+            self._open_form(entry_data["type"])
+        with self._stage("fill"):
+            self._fill_fields(entry_data)
 
         if self.__human_control:
-            self._human_commit()
-        else:
-            self._driver.find_element(*Locators['Form']['CommitButton']).click()
+            return self._human_commit()
+        return self._commit_entry()
 
-        return self
+    def _commit_entry(self) -> bool:
+        """Commits the filled form as stage "commit"
+
+        `_committing` stays set when the commit fails, as the entry may have been saved anyway.
+        Engines clear it before raising when they know it wasn't.
+
+        :returns: was the entry commited
+        """
+        self._committing = True
+        started = time.perf_counter()
+        with self._stage("commit"):
+            self._commit()
+        self._commit_latency = time.perf_counter() - started
+        self._committing = False
+        return True
 
-    def _human_commit(self) -> None:
-        """Asks and waits for human approval or lack thereof before commiting new entry"""
-        commit = input("Commit ?: [y/n] ")
+    def _fill_fields(self, entry_data: ZihRecord) -> None:
+        """Puts values from `entry_data` into the inputs of the opened form, in one script call
+
+        :param entry_data: dict conatining input_ids, respective input values
+                           and other info that's not sent to the form
+
+        :raises MissingFieldsError: when some inputs are not on the form, nothing is filled then
+        """
+        values = {k: str(v) for k, v in entry_data.items() if k not in ["type", "category", "IDX"]}
+        missing = self._driver.execute_script(FILL_FORM, values)
+        if missing:
+            raise MissingFieldsError(missing)
+
+    def _commit(self) -> None:
+        """Commits the filled form and waits for the page ZiHeR responds with
+
+        :raises EntryRejectedError: when ZiHeR shows the form back instead of saving the entry
+        :raises ZiherError: when ZiHeR redirects to the sign-in page instead
+        """
+        button = self._driver.find_element(*Locators['Form']['CommitButton'])
+        click_and_wait(self._driver, button, self._timeouts["page"])
+        if self._signed_out():  # the session expired, ZiHeR didn't take the form
+            self._committing = False
+            raise ZiherError("Signed out by ZiHeR, the entry was not saved")
+        if self._driver.find_elements(By.ID, FormFieldIDs['date']):
+            messages = [e.text for e in self._driver.find_elements(*Locators["Form"]["ErrorMessages"])]
+            raise EntryRejectedError(messages, self._driver.current_url)
+
+    def _discard(self) -> None:
+        """Leaves the filled form without commiting it"""
+        link = self._driver.find_element(*Locators["Form"]["ReturnLink"])
+        click_and_wait(self._driver, link, self._timeouts["page"])
+
+    _COMMIT_PROMPT = "Commit ?: [y/n] "
+
+    def _human_commit(self) -> bool:
+        """Asks and waits for human approval or lack thereof before commiting new entry
+
+        :returns: was the entry commited
+        """
+        with self._stage("review"):
+            commit = input(self._COMMIT_PROMPT)
         if commit == "y":
-            self._driver.find_element(*Locators['Form']['CommitButton']).click()
+            return self._commit_entry()
         elif commit == "n":
-            self._driver.find_element(*Locators["Form"]["ReturnLink"]).click()
+            with self._stage("discard"):
+                self._discard()
+        return False
 
     def __use_dropdown(self, dropdown_text: str, option_text: str):
         """Opens dropdown identified by `dropdown_text` and clicks the options with text containing `option_text`
@@ -239,13 +1044,17 @@ class ZiherPlus:
         :param option_text: text to identify correct dropdown option, can be only a fragment of the full link text, but must be explicit to this option
         """
         dropdown_node_xpth = "//*[contains(@class, 'dropdown')]"
-        self._driver.find_element(
-            By.XPATH, dropdown_node_xpth + f"/a[contains(text(), '{dropdown_text}')]"
+        wait_clickable(
+            self._driver,
+            (By.XPATH, dropdown_node_xpth + f"/a[contains(text(), '{dropdown_text}')]"),
+            self._timeouts["element"],
         ).click()  # open the dropdown
-        time.sleep(1)
-        self._driver.find_element(
-            By.XPATH, dropdown_node_xpth + f"/li/a[contains(text(), '{option_text}')]"
-        ).click()  # click specified option
+        option = wait_clickable(
+            self._driver,
+            (By.XPATH, dropdown_node_xpth + f"/li/a[contains(text(), '{option_text}')]"),
+            self._timeouts["element"],
+        )
+        click_and_wait(self._driver, option, self._timeouts["page"])  # click specified option
 
         return self
 
@@ -266,41 +1075,58 @@ class ZiherPlusSafeMode(ZiherPlus):
     '''Safe version of ZiherPlus driver - this one will NEVER commit any entry. 
     Use to get a preview without importing unwanted data.
 
-    Human-control is ON by default.
+    Human-control is always ON, a `human_control` argument is ignored.
     After asking for commit confirmation this driver will ALWAYS return without commiting.
     '''
-    def __init__(self, driver: WebDriver):
-        super().__init__(driver=driver, human_control=True)
+    def __init__(self, driver: WebDriver, **kwargs):
+        kwargs.pop("human_control", None)
+        super().__init__(driver=driver, human_control=True, **kwargs)
 
     # Convenience constructors for different browsers
     
     @classmethod
-    def Firefox(cls):
-        '''ZiherPlusSafeMode driver for Firefox'''
-        return cls(webdriver.Firefox())
+    def Firefox(cls, **kwargs):
+        '''ZiherPlusSafeMode driver for Firefox, options as in `ZiherPlus.Firefox`'''
+        return cls._launch(zih_browsers.firefox, **kwargs)
     
     @classmethod
-    def Chrome(cls):
-        '''ZiherPlusSafeMode driver for Chrome'''
-        return cls(webdriver.Chrome())
+    def Chrome(cls, **kwargs):
+        '''ZiherPlusSafeMode driver for Chrome, options as in `ZiherPlus.Chrome`'''
+        return cls._launch(zih_browsers.chrome, **kwargs)
     
     @classmethod
-    def Edge(cls):
+    def Edge(cls, **kwargs):
         '''ZiherPlusSafeMode driver for MSEdge'''
-        return cls(webdriver.Edge())
+        return cls(webdriver.Edge(), **kwargs)
     
     @classmethod
-    def Safari(cls):
+    def Safari(cls, **kwargs):
         '''ZiherPlusSafeMode driver for Safari'''
-        return cls(webdriver.Safari())
+        return cls(webdriver.Safari(), **kwargs)
 
     # ==========================================================
     # Private methods
     # ==========================================================
     
-    def _human_commit(self) -> None:
+    _COMMIT_PROMPT = "Commit ?: [n/n] "
+
+    def _human_commit(self) -> bool:
         """Asks and waits for human input before returning,
             NEVER commits entry
         """
-        input("Commit ?: [n/n] ")
-        self._driver.find_element(*Locators["Form"]["ReturnLink"]).click()
\ No newline at end of file
+        with self._stage("review"):
+            input(self._COMMIT_PROMPT)
+        with self._stage("discard"):
+            self._discard()
+        return False
+
+    def _commit_entry(self) -> bool:
+        """Leaves the form like `_discard`, NEVER commits entry - also when nobody is asked,
+        in `review` mode, so the record is reported as skipped and never journaled"""
+        with self._stage("discard"):
+            self._discard()
+        return False
+
+    def _commit(self) -> None:
+        """Leaves the form like `_discard`, NEVER commits entry"""
+        self._discard()
\ No newline at end of file